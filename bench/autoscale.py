@@ -0,0 +1,137 @@
+"""
+simulate the autoscaler with a synthetic load. no cloud costs.
+
+Simulated proxies are Local proxies that take --boot seconds to start like a cloud node.
+Each proxy is rate limited to --capacity requests per second to the fake google. Load
+arrives at a fixed rate per phase regardless of how fast requests complete.
+
+Usage::
+
+    python bench/autoscale.py --phases 10:20 20:120 20:20 --capacity 20 --max-size 10
+"""
+import argparse
+import logging
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from os.path import dirname
+from statistics import quantiles
+from threading import Lock
+from time import perf_counter, sleep
+
+sys.path.insert(0, dirname(__file__))
+
+from fakegoogle import FakeGoogle  # noqa: E402
+
+from mproxy import Manager  # noqa: E402
+from mproxy.proxy.local import Local  # noqa: E402
+from mproxy.source import google  # noqa: E402
+
+
+class Sim(Local):
+    """ local proxy that starts slowly like a cloud node """
+
+    boot = 2
+
+    def start(self):
+        sleep(self.boot)
+        return super().start()
+
+
+def load(m, url, phases, executor):
+    """ send requests at fixed rate per phase
+    :param phases: list of (seconds, requests per second)
+    :return: list of (phase, seconds from start, latency)
+    """
+    lock = Lock()
+    results = []
+    start = perf_counter()
+
+    def request(phase, sent):
+        m.get_session().get(url)
+        with lock:
+            results.append((phase, sent - start, perf_counter() - sent))
+
+    due = start
+    for phase, (seconds, rate) in enumerate(phases):
+        end = due + seconds
+        while due < end:
+            delay = due - perf_counter()
+            if delay > 0:
+                sleep(delay)
+            executor.submit(request, phase, due)
+            due += 1 / rate
+    return results
+
+
+def monitor(m, scaler, seconds, samples):
+    """ record proxies in pool each second """
+    for t in range(int(seconds)):
+        samples.append((t, len(m.proxies), scaler.stats.get("rate", 0)))
+        sleep(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument(
+        "--phases",
+        nargs="+",
+        default=["10:20", "20:120", "20:20"],
+        help="seconds:requests per second",
+    )
+    parser.add_argument("--capacity", type=float, default=20)
+    parser.add_argument("--min-size", type=int, default=1)
+    parser.add_argument("--max-size", type=int, default=10)
+    parser.add_argument("--boot", type=float, default=2)
+    parser.add_argument("--interval", type=float, default=1)
+    parser.add_argument("--up-cooldown", type=float, default=3)
+    parser.add_argument("--down-cooldown", type=float, default=5)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+
+    phases = [tuple(float(x) for x in phase.split(":")) for phase in args.phases]
+    Sim.boot = args.boot
+    fake = FakeGoogle().start()
+    google.URL = fake.url
+    url = f"{fake.url}/search?q=x&num=10"
+
+    m = Manager(rates={fake.ip: args.capacity})
+    m.add(Sim, args.min_size)
+    m.wait(args.min_size)
+    scaler = m.autoscale(
+        Sim,
+        args.min_size,
+        args.max_size,
+        capacity=args.capacity,
+        interval=args.interval,
+        up_cooldown=args.up_cooldown,
+        down_cooldown=args.down_cooldown,
+        drain=5,
+    )
+    samples = []
+    with ThreadPoolExecutor(256) as executor:
+        executor.submit(monitor, m, scaler, sum(s for s, r in phases), samples)
+        results = load(m, url, phases, executor)
+    scaler.stop()
+    m.stop()
+    fake.stop()
+
+    print("second proxies measured_rate")
+    for t, n, rate in samples:
+        print(f"{t:6} {n:7} {rate:8.1f}")
+    print()
+    for phase, (seconds, rate) in enumerate(phases):
+        latencies = [lat for p, t, lat in results if p == phase]
+        p = quantiles(latencies, n=100) if len(latencies) > 1 else [0] * 99
+        print(
+            f"phase {phase} {rate:6.0f}/s for {seconds:.0f}s "
+            f"p50={p[49] * 1000:7.1f}ms p95={p[94] * 1000:7.1f}ms"
+        )
+    proxy_seconds = sum(n for t, n, rate in samples)
+    print(
+        f"proxy seconds={proxy_seconds} "
+        f"static max pool={args.max_size * len(samples)}"
+    )
+
+
+if __name__ == "__main__":
+    main()
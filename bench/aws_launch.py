@@ -0,0 +1,158 @@
+"""
+check AWS batch launch against a stub libcloud driver. no cloud costs or credentials.
+exits 1 on failure so it can run in ci.
+
+Checks Manager.add(AWS, n) creates all n nodes in one create_node request, waits for
+them with one wait_until_running call and renames each node when configured. Checks
+AWS.discover finds the elastic ip of a node left by rotate=eip so stop releases it. Proxy
+ports are not contacted.
+
+Usage::
+
+    python bench/aws_launch.py --nodes 5
+"""
+import argparse
+import logging
+import sys
+from itertools import count
+from threading import Lock
+
+from libcloud.compute.drivers.ec2 import ElasticIP
+from libcloud.compute.types import NodeState
+
+from mproxy import Manager
+from mproxy.proxy.aws import AWS
+
+
+class Node:
+    """ stub libcloud node """
+
+    ips = count(1)
+
+    def __init__(self, name):
+        self.id = f"i-{next(self.ips)}"
+        self.name = name
+        self.state = NodeState.RUNNING
+        self.public_ips = [f"10.0.0.{int(self.id[2:])}"]
+        self.extra = dict(instance_id=self.id, tags=dict())
+
+    def destroy(self):
+        self.state = NodeState.TERMINATED
+
+
+class Driver:
+    """ stub libcloud EC2 driver that records calls """
+
+    region_name = "stub"
+
+    def __init__(self):
+        self.calls = []
+        self.nodes = []
+        self.addresses = []
+        self.lock = Lock()
+
+    def record(self, name, *args, **kwargs):
+        with self.lock:
+            self.calls.append((name, args, kwargs))
+
+    def list_sizes(self):
+        return [type("Size", (), dict(name=AWS.size))()]
+
+    def list_images(self, ex_image_ids=None):
+        return [type("Image", (), dict(id=ex_image_ids[0]))()]
+
+    def list_nodes(self):
+        return list(self.nodes)
+
+    def create_node(self, name, size, image, **kwargs):
+        self.record("create_node", name, **kwargs)
+        nodes = [Node(name) for _ in range(kwargs.get("ex_mincount", 1))]
+        for node in nodes:
+            # ec2 tags nodes with ex_metadata
+            node.extra["tags"].update(
+                {k: str(v) for k, v in kwargs.get("ex_metadata", {}).items()}
+            )
+        self.nodes.extend(nodes)
+        return nodes if len(nodes) > 1 else nodes[0]
+
+    def wait_until_running(self, nodes):
+        self.record("wait_until_running", len(nodes))
+        return [(node, node.public_ips) for node in nodes]
+
+    def ex_create_tags(self, node, tags):
+        self.record("ex_create_tags", node.id, tags)
+        node.extra["tags"].update(tags)
+
+    def ex_describe_all_addresses(self, only_associated=False):
+        return list(self.addresses)
+
+    def ex_disassociate_address(self, eip, domain=None):
+        self.record("ex_disassociate_address", eip.extra["association_id"])
+
+    def ex_release_address(self, eip, domain=None):
+        self.record("ex_release_address", eip.ip)
+
+
+class Stub(AWS):
+    """ AWS with stub driver. proxy is not contacted. """
+
+    def wait_ready(self, ip, timeout=300, interval=0.25):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--nodes", type=int, default=5)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+
+    lc = Driver()
+    m = Manager()
+    futures = m.add(Stub, args.nodes, lc=lc, bootstrap="ami", image="ami-stub")
+    ips = [future.result() for future in futures]
+
+    names = [call[0] for call in lc.calls]
+    creates = [call for call in lc.calls if call[0] == "create_node"]
+    renames = {
+        call[1][0]: call[1][1]["Name"]
+        for call in lc.calls
+        if call[0] == "ex_create_tags" and "Name" in call[1][1]
+    }
+
+    # elastic ip left on a node by a previous run with rotate=eip
+    node = lc.nodes[0]
+    extra = dict(association_id="eipassoc-1")
+    lc.addresses.append(ElasticIP("1.2.3.4", "vpc", node.id, extra=extra))
+    found = {p.node.id: p for p in Stub.discover(lc=lc, bootstrap="ami", image="ami")}
+    found[node.id].stop()
+    released = [call[0] for call in lc.calls if "address" in call[0]]
+
+    checks = [
+        ("one create_node request", len(creates) == 1),
+        (
+            "ex_mincount=ex_maxcount=n",
+            creates
+            and creates[0][2].get("ex_mincount") == args.nodes
+            and creates[0][2].get("ex_maxcount") == args.nodes,
+        ),
+        ("one wait_until_running", names.count("wait_until_running") == 1),
+        ("all nodes ready", len(set(ips)) == args.nodes == len(m.proxies)),
+        ("each node renamed", len(renames) == args.nodes),
+        ("names distinct", len(set(renames.values())) == args.nodes),
+        ("discover finds elastic ip", found[node.id].eip is not None),
+        (
+            "stop releases elastic ip",
+            released == ["ex_disassociate_address", "ex_release_address"],
+        ),
+    ]
+    m.stop()
+
+    failed = False
+    for name, ok in checks:
+        print(f"{name:30} {'ok' if ok else 'FAILED'}")
+        failed = failed or not ok
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
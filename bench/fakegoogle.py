@@ -0,0 +1,127 @@
+"""
+fake google search server for load tests. blocks client ips like google does.
+
+Usage::
+
+    server = FakeGoogle(block_after=200, captcha=0.5).start()
+    google.URL = server.url
+"""
+import random
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+from urllib.parse import parse_qs, urlsplit
+
+CAPTCHA = (
+    "<html><body><div>Our systems have detected unusual traffic from your computer "
+    "network.</div><form action='/sorry/index'><div class='g-recaptcha'></div>"
+    "</form></body></html>"
+)
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        fake = self.server.fake
+        url = urlsplit(self.path)
+        if url.path != "/search":
+            self.reply(404, "not found")
+            return
+        status = fake.check(self.client_address[0])
+        if status == 429:
+            self.reply(429, "too many requests")
+        elif status == "captcha":
+            self.reply(200, CAPTCHA)
+        else:
+            q = parse_qs(url.query)
+            self.reply(200, fake.page(int(q.get("start", [1])[0]), int(q["num"][0])))
+
+    def reply(self, status, body):
+        body = body.encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "text/html; charset=UTF-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class Server(ThreadingHTTPServer):
+    # default backlog of 5 drops connections under load
+    request_queue_size = 128
+    daemon_threads = True
+
+
+class FakeGoogle:
+    """ serves result pages. blocks each client ip after a number of requests """
+
+    def __init__(
+        self, results=1000, block_after=None, captcha=0.0, error_rate=0.0, ip="127.0.0.1"
+    ):
+        """
+        :param results: results available per query
+        :param block_after: requests per client ip before it is blocked. None never.
+        :param captcha: fraction of blocks served as 200 captcha page rather than 429
+        :param error_rate: fraction of requests randomly answered with 429
+        :param ip: server address
+        """
+        self.results = results
+        self.block_after = block_after
+        self.captcha = captcha
+        self.error_rate = error_rate
+        self.ip = ip
+
+        # dict(client ip=requests) and blocked dict(client ip=429 or "captcha")
+        self.lock = Lock()
+        self.requests = dict()
+        self.blocked = dict()
+        self.server = None
+
+    @property
+    def url(self):
+        return f"http://{self.ip}:{self.server.server_address[1]}"
+
+    def start(self):
+        self.server = Server((self.ip, 0), Handler)
+        self.server.fake = self
+        Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def check(self, client):
+        """ return 200, 429 or "captcha" for client request """
+        with self.lock:
+            if client in self.blocked:
+                return self.blocked[client]
+            n = self.requests.get(client, 0) + 1
+            self.requests[client] = n
+            if self.block_after is not None and n > self.block_after:
+                status = "captcha" if random.random() < self.captcha else 429
+                self.blocked[client] = status
+                return status
+        if random.random() < self.error_rate:
+            return 429
+        return 200
+
+    def page(self, start, num):
+        """ return result page html """
+        end = min(start + num - 1, self.results + 1)
+        links = "".join(
+            f'<div class="g"><a href="/url?q=https://site{i}.example.com/page&sa=U">'
+            f"result {i}</a><a href='/search?q=related:{i}'>similar</a></div>"
+            for i in range(start, end)
+        )
+        nxt = (
+            f'<a id="pnnext" href="/search?start={start + num}&num={num}">Next</a>'
+            if end <= self.results
+            else ""
+        )
+        return (
+            f"<html><body><a href='https://www.google.com/preferences'>settings</a>"
+            f"{links}{nxt}</body></html>"
+        )
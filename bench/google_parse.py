@@ -0,0 +1,64 @@
+"""
+benchmark google result page parsers. BeautifulSoup (extract_urls) v lxml (parse_page)
+
+Usage::
+
+    # saved result pages e.g. r.text from google.search
+    python bench/google_parse.py pages/*.html
+
+    # no pages => synthetic page with 99 results
+    python bench/google_parse.py
+"""
+import sys
+from timeit import timeit
+
+from bs4 import BeautifulSoup
+
+from mproxy.source import google
+
+
+def synthetic_page(n=99):
+    """ return html similar to a google result page """
+    results = "".join(
+        f'<div class="g"><a href="/url?q=https://site{i}.com/page{i}&sa=U&ved=x">'
+        f"result {i}</a><a href='https://webcache.googleusercontent.com/{i}'>"
+        f"cached</a><a href='/search?q=related:{i}'>similar</a></div>"
+        for i in range(n)
+    )
+    nav = "".join(f'<a href="/search?q=x&start={i}00">{i}</a>' for i in range(10))
+    return (
+        f"<html><head><title>x</title></head><body>"
+        f"<a href='https://www.google.com/preferences'>settings</a>{results}"
+        f'<div>{nav}<a id="pnnext" href="/search?q=x&start=100">next</a></div>'
+        f"</body></html>"
+    )
+
+
+def old(html):
+    soup = BeautifulSoup(html, "lxml")
+    return google.extract_urls(soup)
+
+
+def new(html):
+    return google.parse_page(html)[0]
+
+
+def main(paths, number=20):
+    pages = [open(path, encoding="utf8").read() for path in paths]
+    if not pages:
+        pages = [synthetic_page()]
+
+    for page in pages:
+        assert old(page) == new(page), "parsers return different urls"
+
+    told = timeit(lambda: [old(page) for page in pages], number=number)
+    tnew = timeit(lambda: [new(page) for page in pages], number=number)
+    n = number * len(pages)
+    print(f"pages={len(pages)} urls/page={len(new(pages[0]))}")
+    print(f"beautifulsoup {told / n * 1000:.2f}ms/page")
+    print(f"lxml          {tnew / n * 1000:.2f}ms/page")
+    print(f"speedup       {told / tnew:.1f}x")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,78 @@
+"""
+check import time stays within budget. exits 1 if over so it can run in ci.
+
+Each statement runs in a fresh interpreter; the interpreter startup time is subtracted.
+Modules that must not be loaded by "import mproxy" are also checked.
+
+Usage::
+
+    python bench/import_time.py
+    python bench/import_time.py --budget 0.1 --repeat 10
+"""
+import argparse
+import subprocess
+import sys
+from statistics import median
+from time import perf_counter
+
+STATEMENTS = ["import mproxy", "from mproxy import Manager"]
+
+# heavy or provider modules loaded on first use only
+LAZY = [
+    "pandas",
+    "libcloud",
+    "fabric",
+    "aiohttp",
+    "lxml",
+    "bs4",
+    "stem",
+    "requests",
+    "mproxy.proxy.aws",
+    "mproxy.proxy.tor",
+]
+
+
+def run(statement, repeat):
+    """ return median seconds to run statement in a new interpreter """
+    times = []
+    for _ in range(repeat):
+        start = perf_counter()
+        subprocess.run([sys.executable, "-c", statement], check=True)
+        times.append(perf_counter() - start)
+    return median(times)
+
+
+def loaded(statement):
+    """ return LAZY modules loaded by statement """
+    check = (
+        f"{statement}; import sys; "
+        f"print(' '.join(m for m in {LAZY!r} if m in sys.modules))"
+    )
+    r = subprocess.run(
+        [sys.executable, "-c", check], check=True, capture_output=True, text=True
+    )
+    return r.stdout.split()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--budget", type=float, default=0.15, help="seconds")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    base = run("pass", args.repeat)
+    ok = True
+    for statement in STATEMENTS:
+        elapsed = max(run(statement, args.repeat) - base, 0)
+        status = "ok" if elapsed <= args.budget else "OVER BUDGET"
+        ok &= elapsed <= args.budget
+        print(f"{statement:30} {elapsed * 1000:7.1f}ms {status}")
+    eager = loaded("import mproxy")
+    if eager:
+        ok = False
+        print(f"import mproxy loads {', '.join(eager)}")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
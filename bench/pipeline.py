@@ -0,0 +1,164 @@
+"""
+load test the proxy pipeline on localhost. no cloud costs and no google blocks.
+
+Local proxies forward to a fake google that blocks each proxy ip after a number of
+requests. Reports throughput, latency percentiles and recovery time after blocks.
+
+Usage::
+
+    python bench/pipeline.py --proxies 4 --concurrency 16 --requests 1000 --block-after 100
+"""
+import argparse
+import logging
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from os.path import dirname
+from statistics import quantiles
+from threading import local
+from time import perf_counter
+
+sys.path.insert(0, dirname(__file__))
+
+from fakegoogle import FakeGoogle  # noqa: E402
+
+from mproxy import Manager, detect  # noqa: E402
+from mproxy.proxy.local import Local  # noqa: E402
+from mproxy.proxysession import ProxyException  # noqa: E402
+from mproxy.source import google  # noqa: E402
+
+
+def report(name, elapsed, latencies, recoveries, failures, results=None):
+    """ print throughput, latency percentiles and recovery time """
+    n = len(latencies)
+    p = quantiles(latencies, n=100) if n > 1 else [0] * 99
+    print(
+        f"{name:15} {n / elapsed:8.1f}/s "
+        f"p50={p[49] * 1000:6.1f}ms p95={p[94] * 1000:6.1f}ms p99={p[98] * 1000:6.1f}ms "
+        f"failed={failures}",
+        end="",
+    )
+    if recoveries:
+        print(
+            f" blocks={len(recoveries)}"
+            f" recovery mean={sum(recoveries) / len(recoveries) * 1000:.1f}ms"
+            f" max={max(recoveries) * 1000:.1f}ms",
+            end="",
+        )
+    if results is not None:
+        print(f" empty={results.count(0)}", end="")
+    print()
+
+
+def run(func, requests, concurrency):
+    """ call func(i) for each request
+    :return: elapsed, list of (latency, blocked, result) and failures
+    """
+    failures = 0
+
+    def target(i):
+        start = perf_counter()
+        blocked, result = func(i)
+        return perf_counter() - start, blocked, result
+
+    start = perf_counter()
+    out = []
+    with ThreadPoolExecutor(concurrency) as executor:
+        for future in [executor.submit(target, i) for i in range(requests)]:
+            try:
+                out.append(future.result())
+            except ProxyException:
+                failures += 1
+    return perf_counter() - start, out, failures
+
+
+def summarise(name, elapsed, out, failures, results=False):
+    latencies = [latency for latency, blocked, result in out]
+    recoveries = [latency for latency, blocked, result in out if blocked]
+    results = [result for latency, blocked, result in out] if results else None
+    report(name, elapsed, latencies, recoveries, failures, results)
+
+
+def bench_manager(m, args):
+    """ raw Manager.get_session. blocked proxies replaced by caller """
+    url = f"{google.URL}/search?q=x&num=10"
+
+    def func(i):
+        blocked = False
+        for _ in range(3):
+            session = m.get_session()
+            try:
+                r = session.get(url)
+                if r.status_code == 200:
+                    return blocked, len(r.content)
+            except ProxyException:
+                # captcha found by block detection
+                pass
+            blocked = True
+            m.block(session.proxies["http"])
+        raise ProxyException
+
+    summarise("manager", *run(func, args.requests, args.concurrency))
+
+
+def bench_proxy_function(m, args):
+    """ google.search wrapped by ProxySession.get_proxy_function. one per thread """
+    threads = local()
+
+    def func(i):
+        if not hasattr(threads, "session"):
+            threads.session = m.get_proxy_session()
+            threads.search = threads.session.get_proxy_function(google.search)
+        before = threads.session.session
+        urls = threads.search(f"query {i}", n=10)
+        # session is replaced when blocked
+        return threads.session.session is not before, len(urls)
+
+    summarise(
+        "proxy_function", *run(func, args.requests, args.concurrency), results=True
+    )
+
+
+def bench_search_many(m, args):
+    """ google.search_many over the whole pool """
+    start = perf_counter()
+    batch = google.search_many(
+        m, (f"query {i}" for i in range(args.requests)), per_proxy=args.per_proxy, n=10
+    )
+    results = [0 if isinstance(urls, Exception) else len(urls) for q, urls in batch]
+    elapsed = perf_counter() - start
+    stats = batch.stats()
+    print(
+        f"{'search_many':15} {stats['per_second']:8.1f}/s "
+        f"failed={stats['failed']} blocks={stats['blocks']} empty={results.count(0)} "
+        f"elapsed={elapsed:.1f}s"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--proxies", type=int, default=4)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--per-proxy", type=int, default=4)
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--block-after", type=int, default=None)
+    parser.add_argument("--captcha", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+
+    fake = FakeGoogle(
+        block_after=args.block_after, captcha=args.captcha, error_rate=args.error_rate
+    ).start()
+    google.URL = fake.url
+    detect.register(fake.ip, *google.rules)
+    for bench in [bench_manager, bench_proxy_function, bench_search_many]:
+        m = Manager()
+        m.add(Local, args.proxies)
+        m.wait(args.proxies)
+        bench(m, args)
+        m.stop()
+    fake.stop()
+
+
+if __name__ == "__main__":
+    main()
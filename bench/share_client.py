@@ -0,0 +1,84 @@
+"""
+check the clients for other processes against Local proxies and the fake google.
+exits 1 on failure so it can run in ci.
+
+Checks that a session from create_client().get_session() sends requests after it is
+pickled to the client and that a lease client runs a Batch e.g. google.search_many.
+
+Usage::
+
+    python bench/share_client.py
+"""
+import argparse
+import logging
+import sys
+from os.path import dirname
+from time import sleep
+
+sys.path.insert(0, dirname(__file__))
+
+from fakegoogle import FakeGoogle  # noqa: E402
+
+from mproxy import (  # noqa: E402
+    Manager,
+    create_client,
+    create_lease_client,
+    create_server,
+)
+from mproxy.proxy.local import Local  # noqa: E402
+from mproxy.source import google  # noqa: E402
+
+
+def attempt(func):
+    """ return result of func or the exception """
+    try:
+        return func()
+    except Exception as e:
+        return e
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--proxies", type=int, default=2)
+    parser.add_argument("--port", type=int, default=4016)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+
+    fake = FakeGoogle().start()
+    url = f"{fake.url}/search?q=x&num=10"
+    m = Manager()
+    m.add(Local, args.proxies)
+    m.wait(args.proxies)
+    create_server(m, port=args.port)
+    sleep(0.5)
+
+    client = create_client(port=args.port)
+    session = attempt(client.get_session)
+    r = attempt(lambda: session.get(url))
+
+    google.URL = fake.url
+    lease = create_lease_client(port=args.port)
+    queries = [f"query {i}" for i in range(10)]
+    results = attempt(lambda: list(google.search_many(lease, queries, n=10)))
+    checks = [
+        ("client session", not isinstance(session, Exception)),
+        ("client session get", getattr(r, "status_code", None) == 200),
+        (
+            "lease client search_many",
+            not isinstance(results, Exception)
+            and len(results) == len(queries)
+            and all(urls and not isinstance(urls, Exception) for q, urls in results),
+        ),
+    ]
+    m.stop()
+    fake.stop()
+
+    failed = False
+    for name, ok in checks:
+        print(f"{name:30} {'ok' if ok else 'FAILED'}")
+        failed = failed or not ok
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
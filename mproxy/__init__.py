@@ -1,5 +1,37 @@
-from .manager import Manager
-from .proxy.aws import AWS
-from .proxy.tor import Tor
-from .source import google
-from .utils.share import create_client, create_server
+"""
+rotating proxies. names below are imported on first use so "import mproxy" is fast and
+does not load provider dependencies such as libcloud, aiohttp or lxml.
+"""
+from importlib import import_module
+
+# dict(name=(module, attribute)). attribute None is the module itself.
+lazy = dict(
+    AsyncManager=(".asyncmanager", "AsyncManager"),
+    AsyncProxySession=(".asyncmanager", "AsyncProxySession"),
+    Manager=(".manager", "Manager"),
+    AWS=(".proxy.aws", "AWS"),
+    Tor=(".proxy.tor", "Tor"),
+    google=(".source.google", None),
+    create_client=(".utils.share", "create_client"),
+    create_lease_client=(".utils.share", "create_lease_client"),
+    create_server=(".utils.share", "create_server"),
+)
+
+__all__ = list(lazy)
+
+
+def __getattr__(name):
+    try:
+        module, attr = lazy[name]
+    except KeyError:
+        raise AttributeError(f"module {__name__} has no attribute {name}") from None
+    value = import_module(module, __name__)
+    if attr is not None:
+        value = getattr(value, attr)
+    # cache so __getattr__ is not called again
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
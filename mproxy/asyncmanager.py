@@ -0,0 +1,224 @@
+import asyncio
+import logging
+from functools import wraps
+from time import perf_counter
+import aiohttp
+
+from . import detect
+from .manager import Manager, get_ip
+from .proxysession import ProxyException
+from .utils import Retry
+
+log = logging.getLogger(__name__)
+
+
+class AsyncSession:
+    """ aiohttp session that sends all requests via one proxy
+
+    Only http proxies are supported (aiohttp has no socks support) so use with AWS not Tor.
+    """
+
+    def __init__(self, proxy, limit=100):
+        """
+        :param proxy: started Proxy object
+        :param limit: maximum simultaneous connections to the proxy
+        """
+        self.proxy = proxy
+        self.proxies = proxy.session.proxies
+        self.session = aiohttp.ClientSession(
+            headers=proxy.session.headers,
+            connector=aiohttp.TCPConnector(limit=limit),
+            trust_env=False,
+        )
+
+    async def get(self, url, params=None, **kwargs):
+        """ return response with body already read. use await r.text() to access """
+        delay = self.proxy.limiter.delay(url)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        self.proxy.begin()
+        start = perf_counter()
+        try:
+            async with self.session.get(
+                url, params=params, proxy=self.proxies["http"], **kwargs
+            ) as r:
+                body = await r.read()
+        except Exception:
+            self.proxy.record(perf_counter() - start, error=True)
+            raise
+        self.proxy.record(
+            perf_counter() - start,
+            error=r.status >= 400,
+            status=r.status,
+            size=len(body),
+        )
+        detect.screen(
+            self.proxy,
+            str(r.url),
+            r.status,
+            r.headers,
+            lambda: body.decode(r.charset or "utf-8", errors="replace"),
+        )
+        return r
+
+    async def close(self):
+        await self.session.close()
+
+
+class AsyncManager:
+    """ asyncio interface to a collection of proxies
+
+    Proxies are provisioned by a Manager in background threads. Each proxy has one
+    AsyncSession so many requests can be in flight from one event loop.
+
+    Usage::
+
+        m = AsyncManager()
+        m.add(AWS, 2)
+        search = m.get_proxy_function(google.asearch)
+        urls = await asyncio.gather(*[search(q) for q in queries])
+    """
+
+    def __init__(self, manager=None, limit=100):
+        """
+        :param manager: Manager that provisions proxies. None creates a new Manager.
+        :param limit: maximum simultaneous connections per proxy
+        """
+        self.manager = manager or Manager()
+        self.limit = limit
+
+        # async sessions dict(ip=AsyncSession)
+        self.sessions = dict()
+
+        # ips being replaced. concurrent tasks often detect the same block.
+        self.blocking = set()
+
+    @property
+    def proxies(self):
+        return self.manager.proxies
+
+    def add(self, proxy_class, n=1, **params):
+        """ add n proxies. provisioning runs in background threads
+        :return: list of futures. use asyncio.wrap_future to await them.
+        """
+        return self.manager.add(proxy_class, n, **params)
+
+    async def remove(self, ip=None):
+        """ stop proxy
+        :param ip: url or ip. None removes the first proxy.
+        """
+        if ip is None:
+            try:
+                ip = list(self.proxies.keys())[0]
+            except IndexError:
+                log.warning("no proxies to remove")
+                return
+        ip = get_ip(ip)
+        await self._close(ip)
+        await asyncio.get_running_loop().run_in_executor(
+            None, self.manager.remove, ip
+        )
+
+    async def block(self, ip):
+        """ treat as blocked. replace.
+        :param ip: url or ip
+        """
+        ip = get_ip(ip)
+        if ip in self.blocking or ip not in self.proxies:
+            return
+        self.blocking.add(ip)
+        try:
+            await self._close(ip)
+            await asyncio.get_running_loop().run_in_executor(
+                None, self.manager.block, ip
+            )
+        finally:
+            self.blocking.discard(ip)
+
+    async def get_session(self):
+        """ return next proxy session """
+        while True:
+            try:
+                # never block the event loop
+                session = self.manager.get_session(timeout=0)
+                break
+            except TimeoutError:
+                await asyncio.get_running_loop().run_in_executor(
+                    None, self.manager.wait, 1
+                )
+        ip = get_ip(session.proxies["http"])
+        try:
+            return self.sessions[ip]
+        except KeyError:
+            s = AsyncSession(self.proxies[ip], limit=self.limit)
+            self.sessions[ip] = s
+            return s
+
+    def get_proxy_session(self):
+        """ return session that will automatically switch proxies """
+        return AsyncProxySession(self)
+
+    def get_proxy_function(self, func):
+        """ return coroutine function that on ProxyException => replaces session and retries
+        :param func: coroutine function to be wrapped. raises ProxyException
+        :return: wrapped function that handles ProxyException.
+        """
+        s = AsyncProxySession(self)
+        return s.get_proxy_function(func)
+
+    async def stop(self):
+        """ stop all proxies """
+        for ip in list(self.sessions):
+            await self._close(ip)
+        await asyncio.get_running_loop().run_in_executor(None, self.manager.stop)
+
+    async def _close(self, ip):
+        """ close async session for ip """
+        s = self.sessions.pop(ip, None)
+        if s is not None:
+            await s.close()
+
+
+class AsyncProxySession:
+    """ an async session that uses rotating proxies """
+
+    def __init__(self, manager):
+        self.manager = manager
+        self.session = None
+
+    def __getattr__(self, attr):
+        """ return attributes from embedded session """
+        return getattr(self.session, attr)
+
+    def get_proxy_function(self, func, tries=2):
+        """ wrap coroutine function with ProxyException handler """
+
+        @Retry(
+            tries=tries,
+            delay=0,
+            exceptions=ProxyException,
+            warn=0,
+            budget=self.manager.manager.budget,
+        )
+        @wraps(func)
+        async def inner(*args, **kwargs):
+            # each call gets next proxy so concurrent calls spread across the pool
+            session = await self.manager.get_session()
+            self.session = session
+            try:
+                return await func(session, *args, **kwargs)
+            except ProxyException:
+                session.proxy.fail()
+                await self.replace(session)
+                raise
+
+        return inner
+
+    async def replace(self, session=None):
+        """ replace proxy
+        :param session: blocked session. None for current session.
+        """
+        session = session or self.session
+        if session is not None:
+            await self.manager.block(session.proxies["http"])
+        self.session = await self.manager.get_session()
@@ -0,0 +1,212 @@
+"""
+autoscaler that adds and retires proxies to match demand
+
+Usage::
+
+    m = Manager(rates=google.rates)
+    scaler = m.autoscale(AWS, min_size=2, max_size=20, capacity=0.5)
+    ...
+    scaler.stop()
+
+Each interval it measures request rate, time requests spend waiting (for a proxy or for
+the rate limiter) and block rate since the last interval. The pool grows when requests
+wait or proxies are blocked too often; it shrinks when demand falls below capacity.
+Retired proxies are taken out of rotation and stopped once their requests finish.
+"""
+import logging
+from math import ceil
+from threading import Event, Thread
+from time import monotonic
+
+log = logging.getLogger(__name__)
+
+
+class Autoscaler:
+    """ keeps number of proxies of one class between min_size and max_size """
+
+    def __init__(
+        self,
+        manager,
+        proxy_class,
+        min_size=1,
+        max_size=10,
+        capacity=None,
+        target_wait=0.05,
+        max_block_rate=0.1,
+        step=1,
+        interval=5,
+        up_cooldown=30,
+        down_cooldown=120,
+        drain=60,
+        params=None,
+    ):
+        """
+        :param manager: Manager
+        :param proxy_class: class of proxies to add e.g. AWS
+        :param min_size: minimum proxies
+        :param max_size: maximum proxies
+        :param capacity: requests per second one proxy should handle e.g. the rate
+            limit. None scales down only when proxies are idle.
+        :param target_wait: mean seconds a request may wait before scaling up
+        :param max_block_rate: blocks per request before scaling up
+        :param step: minimum proxies added when waits or blocks are too high
+        :param interval: seconds between measurements
+        :param up_cooldown: seconds after scaling before scaling up again
+        :param down_cooldown: seconds after scaling before scaling down
+        :param drain: seconds to wait for requests in flight on a retired proxy
+        :param params: passed to proxy_class
+        """
+        self.manager = manager
+        self.proxy_class = proxy_class
+        self.min_size = min_size
+        self.max_size = max_size
+        self.capacity = capacity
+        self.target_wait = target_wait
+        self.max_block_rate = max_block_rate
+        self.step_size = step
+        self.interval = interval
+        self.up_cooldown = up_cooldown
+        self.down_cooldown = down_cooldown
+        self.drain = drain
+        self.params = params or dict()
+
+        # futures for proxies being added and time of last change
+        self.starting = []
+        self.changed = None
+
+        # totals at last measurement
+        self.last = None
+        self.counters = dict()
+
+        # latest measurement and decision
+        self.stats = dict()
+
+        self.stopped = Event()
+        self.thread = None
+
+    def start(self):
+        """ run in background thread
+        :return: self
+        """
+        self.thread = Thread(
+            target=self._run, daemon=True, name=f"autoscale {self.proxy_class.__name__}"
+        )
+        self.thread.start()
+        return self
+
+    def stop(self):
+        """ stop scaling. proxies are left running. """
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+
+    def _run(self):
+        while True:
+            try:
+                self.step()
+            except Exception:
+                log.exception("autoscale step failed")
+            if self.stopped.wait(self.interval):
+                return
+
+    def proxies(self):
+        """ return dict(ip=proxy) for proxies of proxy_class """
+        with self.manager.lock:
+            return {
+                ip: proxy
+                for ip, proxy in self.manager.proxies.items()
+                if isinstance(proxy, self.proxy_class)
+            }
+
+    def measure(self, proxies):
+        """ return demand since last measurement
+        :return: dict(rate=requests per second, wait=mean seconds waiting per request,
+            block_rate=blocks per request, outstanding=requests in flight). None on
+            first call.
+        """
+        now = monotonic()
+        pool = self.manager.metrics.snapshot()
+
+        # proxies come and go so count requests and pacing waits per proxy
+        requests = 0
+        paced = 0.0
+        counters = dict()
+        for proxy in proxies.values():
+            waits = proxy.limiter.stats()["total_wait"]
+            old_counter, old_waits = self.counters.get(proxy, (0, 0.0))
+            requests += proxy.counter - old_counter
+            paced += waits - old_waits
+            counters[proxy] = (proxy.counter, waits)
+        self.counters = counters
+
+        totals = (now, pool["wait_time"]["sum"], pool["replacements"])
+        last = self.last
+        self.last = totals
+        if last is None:
+            return None
+        return dict(
+            rate=requests / (now - last[0]),
+            wait=(totals[1] - last[1] + paced) / requests if requests else 0.0,
+            block_rate=(totals[2] - last[2]) / requests if requests else 0.0,
+            outstanding=sum(proxy.outstanding for proxy in proxies.values()),
+        )
+
+    def desired(self, n, stats):
+        """ return number of proxies needed before applying bounds
+        :param n: current proxies including those starting
+        :param stats: from measure()
+        """
+        overloaded = (
+            stats["wait"] > self.target_wait
+            or stats["block_rate"] > self.max_block_rate
+        )
+        if self.capacity:
+            needed = ceil(stats["rate"] / self.capacity)
+        elif overloaded or stats["outstanding"] >= n / 2:
+            needed = n
+        else:
+            # no capacity so shrink only when idle
+            needed = n - 1
+        if overloaded:
+            # requests queued (little's law) must also be served within an interval
+            queued = stats["rate"] * stats["wait"]
+            capacity = self.capacity or stats["rate"] / max(n, 1)
+            if capacity:
+                backlog = ceil((stats["rate"] + queued / self.interval) / capacity)
+                needed = max(needed, backlog)
+            needed = max(needed, n + self.step_size)
+        return needed
+
+    def step(self):
+        """ measure demand and add or retire proxies
+        :return: change in number of proxies
+        """
+        self.starting = [future for future in self.starting if not future.done()]
+        proxies = self.proxies()
+        n = len(proxies) + len(self.starting)
+        stats = self.measure(proxies)
+
+        desired = n if stats is None else self.desired(n, stats)
+        desired = min(max(desired, self.min_size), self.max_size)
+        self.stats = dict(stats or dict(), proxies=n, desired=desired)
+
+        now = monotonic()
+        since = now - self.changed if self.changed is not None else float("inf")
+        change = 0
+        if desired > n and (n < self.min_size or since >= self.up_cooldown):
+            change = desired - n
+            log.info(f"autoscale adding {change} {self.stats}")
+            self.starting.extend(
+                self.manager.add(self.proxy_class, change, **self.params)
+            )
+        elif desired < n and since >= self.down_cooldown and not self.starting:
+            # least busy first
+            ips = sorted(proxies, key=lambda ip: proxies[ip].outstanding)
+            retire = ips[: n - desired]
+            change = -len(retire)
+            log.info(f"autoscale retiring {-change} {self.stats}")
+            for ip in retire:
+                self.manager.executor.submit(self.manager.retire, ip, self.drain)
+        if change:
+            self.changed = now
+        return change
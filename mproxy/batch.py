@@ -0,0 +1,159 @@
+import logging
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from threading import BoundedSemaphore, Lock
+from time import perf_counter
+
+from .manager import get_ip
+from .proxysession import ProxyException
+
+log = logging.getLogger(__name__)
+
+
+class Batch:
+    """ run a source function for many items spread across the proxy pool
+
+    Usage::
+
+        batch = Batch(m, google.search, queries)
+        for query, urls in batch:
+            ...
+        batch.stats()
+    """
+
+    def __init__(
+        self, manager, func, items, per_proxy=2, tries=2, max_workers=256, **kwargs
+    ):
+        """
+        :param manager: Manager
+        :param func: function(session, item, **kwargs). raises ProxyException.
+        :param items: iterable of items. consumed as work is submitted.
+        :param per_proxy: requests in flight per proxy. total grows with the pool.
+        :param tries: proxies to try per item
+        :param max_workers: maximum requests in flight however many proxies
+        :param kwargs: passed to func
+        """
+        self.manager = manager
+        self.func = func
+        self.items = items
+        self.per_proxy = per_proxy
+        self.tries = tries
+        self.max_workers = max_workers
+        self.kwargs = kwargs
+
+        # dict(proxy=semaphore) limits requests in flight per proxy
+        self.slots = dict()
+
+        # stats
+        self.lock = Lock()
+        self.start = None
+        self.completed = 0
+        self.failed = 0
+        self.blocks = 0
+        self.per_ip = dict()
+
+    def __iter__(self):
+        """ yield (item, result) as completed. result is the exception if all tries failed """
+        self.manager.wait(1)
+        self.start = perf_counter()
+        items = iter(self.items)
+        # threads start on demand so max_workers only caps them
+        executor = ThreadPoolExecutor(self.max_workers, thread_name_prefix="batch")
+        with executor:
+            futures = dict()
+            for item in items:
+                futures[executor.submit(self.run, item)] = item
+                if len(futures) >= self.workers():
+                    break
+            while futures:
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    item = futures.pop(future)
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        # one item failing does not stop the batch
+                        result = e
+                    yield item, result
+                # pool may have grown since the last submit
+                for item in items:
+                    futures[executor.submit(self.run, item)] = item
+                    if len(futures) >= self.workers():
+                        break
+
+    def workers(self):
+        """ return items to keep in flight for current pool size """
+        return min(self.max_workers, self.per_proxy * max(len(self.manager.proxies), 1))
+
+    def slot(self, proxy):
+        """ return semaphore that limits requests in flight on proxy """
+        with self.lock:
+            try:
+                return self.slots[proxy]
+            except KeyError:
+                slot = BoundedSemaphore(self.per_proxy)
+                self.slots[proxy] = slot
+                return slot
+
+    def acquire(self):
+        """ return session and slot for a proxy with fewer than per_proxy in flight """
+        session = self.manager.get_session()
+        slot = self.slot(session.proxy)
+        if slot.acquire(blocking=False):
+            return session, slot
+        # weighted strategies may select the same busy proxy so take any free one
+        with self.manager.lock:
+            ready = list(self.manager.ready)
+        for proxy in ready:
+            other = self.slot(proxy)
+            if other.acquire(blocking=False):
+                return self.manager.session(proxy), other
+        # all busy so wait for the selected proxy
+        slot.acquire()
+        return session, slot
+
+    def run(self, item):
+        """ run func for one item. on ProxyException replace proxy and retry. other
+        exceptions fail the item without retry.
+        """
+        for n in range(self.tries):
+            session, slot = self.acquire()
+            ip = get_ip(session.proxies["http"])
+            try:
+                result = self.func(session, item, **self.kwargs)
+            except ProxyException:
+                session.proxy.fail()
+                with self.lock:
+                    self.blocks += 1
+                self.manager.block(ip)
+                if n == self.tries - 1:
+                    with self.lock:
+                        self.failed += 1
+                    log.warning(f"failed {item} after {self.tries} tries")
+                    raise
+                continue
+            except Exception:
+                with self.lock:
+                    self.failed += 1
+                log.exception(f"failed {item}")
+                raise
+            finally:
+                slot.release()
+            with self.lock:
+                self.completed += 1
+                self.per_ip[ip] = self.per_ip.get(ip, 0) + 1
+            return result
+
+    def stats(self):
+        """ return dict of throughput stats """
+        with self.lock:
+            elapsed = perf_counter() - self.start if self.start else 0
+            return dict(
+                completed=self.completed,
+                failed=self.failed,
+                blocks=self.blocks,
+                elapsed=elapsed,
+                per_second=self.completed / elapsed if elapsed else 0,
+                per_proxy_per_second={
+                    ip: n / elapsed if elapsed else 0 for ip, n in self.per_ip.items()
+                },
+            )
@@ -0,0 +1,128 @@
+"""
+block detection. sources register rules for their domains and proxy sessions screen
+every response against them.
+
+Usage::
+
+    from mproxy import detect
+
+    detect.register(
+        "example.com",
+        detect.Rule("captcha", body=r"g-recaptcha"),
+        detect.Rule("slow down", status=[503], hard=False),
+    )
+
+A hard rule raises ProxyException so the caller replaces the proxy straight away. A soft
+rule lowers the proxy's weight for selection strategies such as EWMA; several soft
+signals in a row count as a block.
+"""
+import logging
+import re
+from functools import lru_cache
+from threading import Lock
+from urllib.parse import urlparse
+
+from .proxysession import ProxyException
+
+log = logging.getLogger(__name__)
+
+# soft signals in a row that count as a block
+escalate = 3
+
+# dict(domain=list of Rule)
+rules = dict()
+rules_lock = Lock()
+
+
+class Rule:
+    """ signature of a blocked response. all conditions given must match. """
+
+    def __init__(self, name, status=None, headers=None, body=None, url=None, hard=True):
+        """
+        :param name: reason reported when matched
+        :param status: list of status codes
+        :param headers: dict(header=regex) searched in response headers
+        :param body: regex searched in response text. case insensitive.
+        :param url: regex searched in final url e.g. after a redirect
+        :param hard: True if proxy is blocked. False if suspected.
+        """
+        self.name = name
+        self.status = None if status is None else set(status)
+        self.headers = {k: re.compile(v, re.I) for k, v in (headers or {}).items()}
+        self.body = None if body is None else re.compile(body, re.I)
+        self.url = None if url is None else re.compile(url)
+        self.hard = hard
+
+    def match(self, url, status, headers, text):
+        """ return True if response matches
+        :param text: function that returns response text. None if not available.
+        """
+        if self.status is not None and status not in self.status:
+            return False
+        if self.url is not None and not self.url.search(url):
+            return False
+        for header, pattern in self.headers.items():
+            if not pattern.search(headers.get(header, "")):
+                return False
+        if self.body is not None and (text is None or not self.body.search(text())):
+            return False
+        return True
+
+
+def register(domain, *new):
+    """ add rules for domain and its subdomains """
+    with rules_lock:
+        rules.setdefault(domain, []).extend(new)
+
+
+def get_rules(url):
+    """ return rules that apply to url """
+    host = urlparse(url).hostname or ""
+    with rules_lock:
+        return [
+            rule
+            for domain, domain_rules in rules.items()
+            if host == domain or host.endswith(f".{domain}")
+            for rule in domain_rules
+        ]
+
+
+def check(url, status, headers, text=None):
+    """ return first rule matching response or None
+    :param url: final url
+    :param status: status code
+    :param headers: response headers
+    :param text: function that returns response text. None if not available.
+    """
+    domain_rules = get_rules(url)
+    if not domain_rules:
+        return None
+    if text is not None:
+        # decode once however many body rules there are
+        text = lru_cache(maxsize=None)(text)
+    for rule in domain_rules:
+        if rule.match(url, status, headers, text):
+            return rule
+    return None
+
+
+def screen(proxy, url, status, headers, text=None):
+    """ check response and act on any rule matched. see check for parameters.
+    :raises ProxyException: hard block or too many soft signals
+    """
+    rule = check(url, status, headers, text)
+    if rule is None:
+        return
+    if rule.hard:
+        raise ProxyException(f"{rule.name} {url}")
+    soft(proxy, rule.name)
+
+
+def soft(proxy, reason):
+    """ record suspected block e.g. empty results
+    :raises ProxyException: after escalate suspected blocks in a row
+    """
+    n = proxy.fail(soft=True)
+    log.info(f"suspected block {reason} ({n} in a row)")
+    if n >= escalate:
+        raise ProxyException(f"{reason} {n} times in a row")
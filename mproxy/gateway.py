@@ -0,0 +1,373 @@
+"""
+local forward proxy in front of the pool. any http client can use rotating proxies.
+
+Usage::
+
+    m = Manager()
+    m.add(AWS, 10)
+    gateway = m.serve(port=8899)
+
+    curl -x http://127.0.0.1:8899 https://example.com
+    scrapy: meta["proxy"] = "http://127.0.0.1:8899"
+
+Each request (or CONNECT tunnel) goes via the next proxy selected by the Manager. Http
+responses are screened by the detect rules registered for the destination; a hard block
+blocks the proxy and retries on another. Responses are streamed to the client. Https
+blocks are only visible when the CONNECT fails; blocks inside the tunnel must be
+reported by the client with Manager.block.
+"""
+import asyncio
+import base64
+import logging
+from threading import Event, Thread
+from time import perf_counter
+from urllib.parse import unquote, urlsplit
+
+from requests.structures import CaseInsensitiveDict
+
+from . import detect
+
+log = logging.getLogger(__name__)
+
+# headers that apply to one connection and are not forwarded
+HOP = {
+    "connection",
+    "keep-alive",
+    "proxy-authorization",
+    "proxy-connection",
+    "te",
+    "trailer",
+    "upgrade",
+}
+
+
+def close_head(head):
+    """ return response head with hop headers replaced by Connection: close
+    :param head: raw response head from upstream including the blank line
+    """
+    lines = head[: -len(b"\r\n\r\n")].split(b"\r\n")
+    lines = [lines[0]] + [
+        line
+        for line in lines[1:]
+        if line.split(b":", 1)[0].strip().decode("latin-1").lower() not in HOP
+    ]
+    lines.append(b"Connection: close")
+    return b"\r\n".join(lines) + b"\r\n\r\n"
+
+
+def get_headers(head):
+    """ return headers from raw response head for detect rules """
+    return CaseInsensitiveDict(
+        tuple(part.strip() for part in line.split(":", 1))
+        for line in head.decode("latin-1").split("\r\n")[1:]
+        if ":" in line
+    )
+
+
+class Gateway:
+    """ asyncio forward proxy that spreads requests across Manager proxies
+
+    Upstream proxies must be http proxies e.g. AWS or Local rather than Tor socks.
+    """
+
+    def __init__(
+        self,
+        manager,
+        ip="127.0.0.1",
+        port=8899,
+        tries=3,
+        block_status=(403, 429, 503),
+        timeout=30,
+    ):
+        """
+        :param manager: Manager
+        :param ip: address to listen on
+        :param port: port to listen on. 0 for any free port.
+        :param tries: proxies to try per request before giving up
+        :param block_status: CONNECT statuses from the upstream proxy that block it.
+            http responses are screened by detect rules for the destination instead.
+        :param timeout: seconds to wait for a proxy, connection or response head. also
+            the longest pause while a response body is streamed.
+        """
+        self.manager = manager
+        self.ip = ip
+        self.port = port
+        self.tries = tries
+        self.block_status = set(block_status)
+        self.timeout = timeout
+        self.loop = None
+        self.server = None
+
+    @property
+    def url(self):
+        return f"http://{self.ip}:{self.port}"
+
+    def start(self):
+        """ serve in a background thread
+        :return: self
+        """
+        started = Event()
+        self.loop = asyncio.new_event_loop()
+        Thread(
+            target=self._run, args=(started,), daemon=True, name=f"gateway {self.url}"
+        ).start()
+        started.wait()
+        log.info(f"gateway listening on {self.url}")
+        return self
+
+    def _run(self, started):
+        asyncio.set_event_loop(self.loop)
+        self.server = self.loop.run_until_complete(
+            asyncio.start_server(self.handle, self.ip, self.port, backlog=1024)
+        )
+        self.port = self.server.sockets[0].getsockname()[1]
+        started.set()
+        self.loop.run_forever()
+
+    def stop(self):
+        """ stop listening. open tunnels are dropped. """
+
+        async def close():
+            self.server.close()
+            await self.server.wait_closed()
+
+        asyncio.run_coroutine_threadsafe(close(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+    async def handle(self, reader, writer):
+        """ handle one client connection """
+        try:
+            head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), self.timeout)
+        except (
+            asyncio.IncompleteReadError,
+            asyncio.LimitOverrunError,
+            asyncio.TimeoutError,
+            OSError,
+        ):
+            writer.close()
+            return
+        lines = head.decode("latin-1").split("\r\n")
+        try:
+            method, target, _ = lines[0].split(" ", 2)
+        except ValueError:
+            await self.reply(writer, 400, "Bad Request")
+            return
+        headers = [
+            tuple(part.strip() for part in line.split(":", 1))
+            for line in lines[1:]
+            if ":" in line
+        ]
+        try:
+            if method == "CONNECT":
+                await self.tunnel(target, reader, writer)
+            elif any(
+                k.lower() == "transfer-encoding" and v.lower() != "identity"
+                for k, v in headers
+            ):
+                # chunked bodies are not decoded so ask for content-length
+                await self.reply(writer, 411, "Length Required")
+            else:
+                length = int(
+                    next((v for k, v in headers if k.lower() == "content-length"), 0)
+                )
+                body = await reader.readexactly(length) if length else b""
+                await self.forward(method, target, headers, body, writer)
+        except TimeoutError:
+            await self.reply(writer, 503, "No Proxy Available")
+        except Exception:
+            log.exception(f"gateway failed {method} {target}")
+            await self.reply(writer, 502, "Bad Gateway")
+        finally:
+            writer.close()
+
+    async def reply(self, writer, status, reason):
+        """ send error response to client """
+        try:
+            writer.write(
+                f"HTTP/1.1 {status} {reason}\r\nContent-Length: 0\r\n"
+                f"Connection: close\r\n\r\n".encode()
+            )
+            await writer.drain()
+        except OSError:
+            pass
+        writer.close()
+
+    async def upstream(self, url):
+        """ open connection to next proxy
+        :return: session, reader, writer, proxy-authorization header
+        """
+        loop = asyncio.get_running_loop()
+        session = await loop.run_in_executor(
+            None, self.manager.get_session, self.timeout
+        )
+        u = urlsplit(session.proxies["http"])
+        if u.scheme != "http":
+            raise ValueError(f"gateway needs http proxies not {u.scheme}")
+        auth = ""
+        if u.username:
+            creds = f"{unquote(u.username)}:{unquote(u.password or '')}"
+            creds = base64.b64encode(creds.encode()).decode()
+            auth = f"Proxy-Authorization: Basic {creds}\r\n"
+        delay = session.proxy.limiter.delay(url)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        session.proxy.begin()
+        try:
+            reader, writer = await asyncio.wait_for(
+                asyncio.open_connection(u.hostname, u.port), self.timeout
+            )
+        except (OSError, asyncio.TimeoutError) as e:
+            session.proxy.record(0, error=True)
+            await self.block(session)
+            raise ConnectionError(f"cannot connect to {u.netloc}") from e
+        return session, reader, writer, auth
+
+    async def block(self, session):
+        """ report proxy blocked """
+        log.info(f"gateway blocking {session.proxies['http']}")
+        session.proxy.fail()
+        await asyncio.get_running_loop().run_in_executor(
+            None, self.manager.block, session.proxies["http"]
+        )
+
+    async def forward(self, method, url, headers, body, writer):
+        """ send request via proxies until one is not blocked. response is streamed. """
+        headers = "".join(f"{k}: {v}\r\n" for k, v in headers if k.lower() not in HOP)
+        for n in range(self.tries):
+            try:
+                session, up_reader, up_writer, auth = await self.upstream(url)
+            except ConnectionError:
+                continue
+            start = perf_counter()
+            request = (
+                f"{method} {url} HTTP/1.1\r\n{headers}{auth}Connection: close\r\n\r\n"
+            )
+            try:
+                up_writer.write(request.encode("latin-1") + body)
+                await up_writer.drain()
+                # timeout applies to the head. the body streams however long it takes.
+                head = await asyncio.wait_for(
+                    up_reader.readuntil(b"\r\n\r\n"), self.timeout
+                )
+                status = int(head.split(b" ", 2)[1])
+            except (
+                OSError,
+                asyncio.TimeoutError,
+                asyncio.IncompleteReadError,
+                asyncio.LimitOverrunError,
+                IndexError,
+                ValueError,
+            ):
+                session.proxy.record(perf_counter() - start, error=True)
+                up_writer.close()
+                await self.block(session)
+                continue
+            # body rules are not checked as the body is streamed
+            rule = detect.check(url, status, get_headers(head))
+            blocked = rule is not None and rule.hard
+            if blocked and n < self.tries - 1:
+                log.info(f"gateway {rule.name} {url}")
+                session.proxy.record(perf_counter() - start, error=True, status=status)
+                up_writer.close()
+                await self.block(session)
+                continue
+            if rule is not None and not rule.hard:
+                session.proxy.fail(soft=True)
+            # last response is returned even if blocked
+            try:
+                size = await self.stream(head, up_reader, writer)
+            finally:
+                up_writer.close()
+            session.proxy.record(
+                perf_counter() - start,
+                error=size is None or status >= 400,
+                status=status,
+                size=size or 0,
+            )
+            if blocked:
+                await self.block(session)
+            return
+        await self.reply(writer, 502, "Bad Gateway")
+
+    async def stream(self, head, reader, writer):
+        """ send response head then body to client as it arrives
+        :return: bytes of body sent. None if the upstream or client failed midway.
+        """
+        size = 0
+        try:
+            writer.write(close_head(head))
+            while True:
+                chunk = await asyncio.wait_for(reader.read(65536), self.timeout)
+                if not chunk:
+                    return size
+                size += len(chunk)
+                writer.write(chunk)
+                await writer.drain()
+        except (OSError, asyncio.TimeoutError):
+            # head already sent so the client sees a truncated response
+            log.warning(f"gateway response stopped after {size} bytes")
+            return None
+
+    async def tunnel(self, target, reader, writer):
+        """ open CONNECT tunnel via proxies until one accepts """
+        for n in range(self.tries):
+            try:
+                session, up_reader, up_writer, auth = await self.upstream(
+                    f"https://{target}"
+                )
+            except ConnectionError:
+                continue
+            start = perf_counter()
+            request = f"CONNECT {target} HTTP/1.1\r\nHost: {target}\r\n{auth}\r\n"
+            try:
+                up_writer.write(request.encode())
+                await up_writer.drain()
+                head = await asyncio.wait_for(
+                    up_reader.readuntil(b"\r\n\r\n"), self.timeout
+                )
+                status = int(head.split(b" ", 2)[1])
+            except (
+                OSError,
+                asyncio.TimeoutError,
+                asyncio.IncompleteReadError,
+                IndexError,
+                ValueError,
+            ):
+                session.proxy.record(perf_counter() - start, error=True)
+                up_writer.close()
+                await self.block(session)
+                continue
+            elapsed = perf_counter() - start
+            if status != 200:
+                session.proxy.record(elapsed, error=True, status=status)
+                up_writer.close()
+                if status in self.block_status:
+                    await self.block(session)
+                    continue
+                writer.write(head)
+                await writer.drain()
+                return
+            writer.write(b"HTTP/1.1 200 Connection established\r\n\r\n")
+            await writer.drain()
+            try:
+                await asyncio.gather(pipe(reader, up_writer), pipe(up_reader, writer))
+            finally:
+                # outstanding covers the life of the tunnel
+                session.proxy.record(elapsed, status=status)
+            return
+        await self.reply(writer, 502, "Bad Gateway")
+
+
+async def pipe(reader, writer):
+    """ copy bytes until eof then close writer """
+    try:
+        while True:
+            data = await reader.read(65536)
+            if not data:
+                break
+            writer.write(data)
+            await writer.drain()
+    except OSError:
+        pass
+    finally:
+        writer.close()
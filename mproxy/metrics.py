@@ -0,0 +1,194 @@
+"""
+metrics for proxies and the pool. Manager.snapshot() collects them; prometheus() formats them.
+"""
+from bisect import bisect_left
+from collections import Counter
+from threading import Lock, Thread
+from time import time
+
+# seconds
+BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+
+class Histogram:
+    """ cumulative histogram. caller holds lock. """
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def snapshot(self):
+        cumulative = []
+        total = 0
+        for bucket, n in zip(self.buckets + ("+Inf",), self.counts):
+            total += n
+            cumulative.append((bucket, total))
+        return dict(buckets=cumulative, sum=self.sum, count=self.count)
+
+
+class ProxyMetrics:
+    """ per proxy metrics. updated by Proxy under its stats_lock """
+
+    def __init__(self):
+        self.started = time()
+        self.requests = 0
+        self.errors = 0
+        self.blocks = 0
+        self.suspects = 0
+        self.bytes = 0
+        self.latency = Histogram()
+        self.status = Counter()
+
+    def observe(self, elapsed, error, status, size):
+        self.requests += 1
+        self.errors += bool(error)
+        self.bytes += size
+        self.latency.observe(elapsed)
+        if status is not None:
+            self.status[status] += 1
+
+    def snapshot(self):
+        return dict(
+            requests=self.requests,
+            errors=self.errors,
+            blocks=self.blocks,
+            suspects=self.suspects,
+            bytes=self.bytes,
+            uptime=time() - self.started,
+            latency=self.latency.snapshot(),
+            status=dict(self.status),
+        )
+
+
+class PoolMetrics:
+    """ pool metrics updated by Manager """
+
+    def __init__(self):
+        self.lock = Lock()
+        self.started = time()
+        self.provisioned = 0
+        self.provision_failures = 0
+        self.replacements = 0
+        self.provision_time = Histogram()
+        self.wait_time = Histogram((0.001, 0.01) + BUCKETS)
+
+    def provision(self, elapsed, ok=True):
+        with self.lock:
+            if ok:
+                self.provisioned += 1
+                self.provision_time.observe(elapsed)
+            else:
+                self.provision_failures += 1
+
+    def wait(self, elapsed):
+        with self.lock:
+            self.wait_time.observe(elapsed)
+
+    def replace(self):
+        with self.lock:
+            self.replacements += 1
+
+    def snapshot(self):
+        with self.lock:
+            uptime = time() - self.started
+            return dict(
+                uptime=uptime,
+                provisioned=self.provisioned,
+                provision_failures=self.provision_failures,
+                replacements=self.replacements,
+                replacements_per_hour=self.replacements / uptime * 3600,
+                provision_time=self.provision_time.snapshot(),
+                wait_time=self.wait_time.snapshot(),
+            )
+
+
+def prometheus(snapshot):
+    """ return Manager.snapshot() in prometheus text format """
+    lines = []
+
+    def add(name, value, labels=None, kind=None):
+        if kind:
+            lines.append(f"# TYPE mproxy_{name} {kind}")
+        labels = ",".join(f'{k}="{v}"' for k, v in (labels or {}).items())
+        labels = f"{{{labels}}}" if labels else ""
+        lines.append(f"mproxy_{name}{labels} {value}")
+
+    def histogram(name, h, labels=None):
+        labels = labels or dict()
+        for bucket, n in h["buckets"]:
+            add(f"{name}_bucket", n, dict(labels, le=bucket))
+        add(f"{name}_sum", h["sum"], labels)
+        add(f"{name}_count", h["count"], labels)
+
+    pool = snapshot["pool"]
+    add("proxies", len(snapshot["proxies"]), kind="gauge")
+    add("spares", sum(snapshot["spares"]["spares"].values()), kind="gauge")
+    add("uptime_seconds", pool["uptime"], kind="gauge")
+    add("provisioned_total", pool["provisioned"], kind="counter")
+    add("provision_failures_total", pool["provision_failures"], kind="counter")
+    add("replacements_total", pool["replacements"], kind="counter")
+    lines.append("# TYPE mproxy_provision_seconds histogram")
+    histogram("provision_seconds", pool["provision_time"])
+    lines.append("# TYPE mproxy_wait_seconds histogram")
+    histogram("wait_seconds", pool["wait_time"])
+
+    proxies = snapshot["proxies"].items()
+    for name, kind in [
+        ("requests", "counter"),
+        ("errors", "counter"),
+        ("blocks", "counter"),
+        ("suspects", "counter"),
+        ("bytes", "counter"),
+        ("uptime", "gauge"),
+    ]:
+        suffix = "_total" if kind == "counter" else "_seconds"
+        lines.append(f"# TYPE mproxy_proxy_{name}{suffix} {kind}")
+        for ip, p in proxies:
+            add(f"proxy_{name}{suffix}", p[name], dict(ip=ip))
+    for name, key in [("connections", "connections"), ("idle_connections", "idle")]:
+        lines.append(f"# TYPE mproxy_proxy_{name} gauge")
+        for ip, p in proxies:
+            add(f"proxy_{name}", p["pool"][key], dict(ip=ip))
+    lines.append("# TYPE mproxy_proxy_responses_total counter")
+    for ip, p in proxies:
+        for status, n in p["status"].items():
+            add("proxy_responses_total", n, dict(ip=ip, status=status))
+    lines.append("# TYPE mproxy_proxy_latency_seconds histogram")
+    for ip, p in proxies:
+        histogram("proxy_latency_seconds", p["latency"], dict(ip=ip))
+    return "\n".join(lines) + "\n"
+
+
+def serve(manager, port=9100, ip="127.0.0.1"):
+    """ serve manager metrics at http://ip:port/metrics in a background thread
+    :return: server. server.shutdown() to stop.
+    """
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path != "/metrics":
+                self.send_error(404)
+                return
+            body = prometheus(manager.snapshot()).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((ip, port), Handler)
+    Thread(
+        target=server.serve_forever, daemon=True, name=f"metrics port={port}"
+    ).start()
+    return server
@@ -1,21 +1,26 @@
 import logging
 from configparser import ConfigParser
-from threading import Thread
+from datetime import datetime, timezone
+from threading import Lock
 
-import pandas as pd
-from fabric import Connection
 from libcloud.compute.providers import get_driver
 from libcloud.compute.types import NodeState, Provider
 
 from ..utils import Retry
-from .proxy import HERE, HOME, Proxy, names
+from .proxy import HERE, HOME, Proxy, get_name
 
 log = logging.getLogger(__name__)
 
 
-def get_libcloud(region=None):
+# cache of dict((region, size, image)=(NodeSize, NodeImage))
+sizes_images = dict()
+sizes_images_lock = Lock()
+
+
+def get_libcloud(region=None, **kwargs):
     """ get libcloud driver
     :param region: None uses default region from ~/.aws/config
+    :param kwargs: passed to driver e.g. host, port, secure for a local EC2 stand-in
     """
     cfg = ConfigParser()
     cfg.read(f"{HOME}/.aws/credentials")
@@ -25,20 +30,104 @@ def get_libcloud(region=None):
         cfg.read(f"{HOME}/.aws/config")
         region = cfg.get("default", "region")
     cls = get_driver(Provider.EC2)
-    lc = cls(access, secret, region=region)
+    lc = cls(access, secret, region=region, **kwargs)
     return lc
 
 
+def get_size_image(lc, size, image):
+    """ return NodeSize and NodeImage. cached per region to save api calls. """
+    key = (lc.region_name, size, image)
+    with sizes_images_lock:
+        try:
+            return sizes_images[key]
+        except KeyError:
+            pass
+    result = (
+        [s for s in lc.list_sizes() if s.name == size][0],
+        lc.list_images(ex_image_ids=[image])[0],
+    )
+    with sizes_images_lock:
+        sizes_images[key] = result
+    return result
+
+
+def get_userdata():
+    """ return cloud-init script that installs and configures tinyproxy """
+    # text mode converts the crlf line endings
+    with open(f"{HERE}/tinyproxy.conf") as f:
+        conf = f.read()
+    # config is written first and kept by apt so the stock config never serves
+    return (
+        "#!/bin/bash\n"
+        "mkdir -p /etc/tinyproxy\n"
+        "cat > /etc/tinyproxy/tinyproxy.conf <<'EOF'\n"
+        f"{conf}\n"
+        "EOF\n"
+        "apt-get -qq update\n"
+        "apt-get -y -qq -o Dpkg::Options::=--force-confold install tinyproxy\n"
+        "service tinyproxy restart\n"
+    )
+
+
 class AWS(Proxy):
-    """ proxy on AWS """
+    """ proxy on AWS
+
+    bootstrap modes to install tinyproxy:
 
-    def __init__(self, name=None, region=None):
+    * ssh - install via ssh after node starts
+    * userdata - node installs itself on first boot using cloud-init. no ssh.
+    * ami - image already has tinyproxy installed. create image once with AWS.bake()
+
+    rotate modes to change ip when blocked without launching a new node:
+
+    * eip - associate a new elastic ip. fastest. aws allows 5 per region by default.
+    * restart - stop and start the node. needs spot=False and a size that supports stop.
+    """
+
+    # ubuntu
+    size = "t3.nano"
+    image = "ami-03d8261f577d71b6a"
+
+    # seconds after launch that a node never made ready is treated as orphaned
+    stale = 900
+
+    def __init__(
+        self,
+        name=None,
+        region=None,
+        lc=None,
+        bootstrap="ssh",
+        image=None,
+        rotate=None,
+        spot=True,
+    ):
         """
         :param name: create object for existing node
         :param region: None uses default region from ~/.aws/config
+        :param lc: libcloud driver. None creates driver for region.
+        :param bootstrap: ssh, userdata or ami
+        :param image: ami id. required for bootstrap=ami.
+        :param rotate: eip, restart or None to replace node when blocked
+        :param spot: launch spot instances. False for on demand e.g. rotate=restart.
         """
         super().__init__()
-        self.lc = get_libcloud(region=region)
+        if bootstrap not in ("ssh", "userdata", "ami"):
+            raise ValueError(f"unknown bootstrap {bootstrap}")
+        if rotate not in ("eip", "restart", None):
+            raise ValueError(f"unknown rotate {rotate}")
+        if rotate == "restart" and spot:
+            # one time spot requests cannot be stopped
+            raise ValueError("rotate=restart requires spot=False")
+        self.spot = spot
+        self.rotate_mode = rotate
+        self.rotates = rotate is not None
+        self.eip = None
+        if bootstrap == "ami" and not image:
+            raise ValueError("bootstrap=ami requires image. create with AWS.bake()")
+        self.bootstrap = bootstrap
+        self.image = image or self.image
+        self.lc = lc or get_libcloud(region=region)
+        self.name = name or get_name()
         if name:
             try:
                 self.node = [n for n in self.lc.list_nodes() if n.name == name][0]
@@ -50,31 +139,184 @@ class AWS(Proxy):
         """ return list of nodes """
         return [n for n in self.lc.list_nodes()]
 
-    def start(self):
-        """ start node
+    @classmethod
+    def launch(cls, n, **params):
+        """ create n nodes with one api request and one wait
+        :param params: passed to AWS()
+        :return: list of AWS with running nodes. call configure() on each to start proxy.
+        """
+        proxies = [cls(**params)]
+        params = dict(params, lc=proxies[0].lc)
+        proxies.extend(cls(**params) for _ in range(n - 1))
+        nodes = proxies[0].create_nodes(n)
+        for proxy, node in zip(proxies, nodes):
+            proxy.node = node
+        return proxies
+
+    @classmethod
+    def discover(cls, **params):
+        """ find nodes left running by a previous run and destroy stale nodes
+
+        stale nodes are proxy nodes that were never made ready (e.g. the previous run
+        crashed while configuring) or were left stopped mid rotate. nodes are adopted
+        regardless of owner so do not share the account with another running Manager.
+
+        :param params: passed to AWS()
+        :return: list of AWS for running ready nodes. call adopt() on each to use it.
+        """
+        first = cls(**params)
+        lc = first.lc
+        params = dict(params, lc=lc)
+        proxies = []
+        now = datetime.now(timezone.utc)
+        # elastic ips from rotate=eip. released when the adopted proxy stops.
+        eips = {
+            address.instance_id: address
+            for address in lc.ex_describe_all_addresses(only_associated=True)
+        }
+        for node in lc.list_nodes():
+            tags = node.extra.get("tags", {})
+            if tags.get("app") != "proxy" or node.state in (
+                NodeState.TERMINATED,
+                NodeState.STOPPING,
+            ):
+                continue
+            if node.state == NodeState.RUNNING and tags.get("ready") == "True":
+                proxy = first if not proxies else cls(**params)
+                proxy.node = node
+                proxy.name = node.name
+                proxy.eip = eips.get(node.id)
+                proxies.append(proxy)
+                continue
+            launched = node.extra.get("launch_time")
+            if not launched:
+                continue
+            age = now - datetime.fromisoformat(launched.replace("Z", "+00:00"))
+            if age.total_seconds() > cls.stale:
+                log.warning(f"destroying stale node {node.name} {node.state}")
+                eip = eips.get(node.id)
+                if eip is not None:
+                    lc.ex_disassociate_address(eip, domain="vpc")
+                lc.destroy_node(node)
+                if eip is not None:
+                    lc.ex_release_address(eip, domain="vpc")
+        log.info(f"found {len(proxies)} ready nodes")
+        return proxies
+
+    def adopt(self, timeout=10):
+        """ check proxy on existing node works
+        :param timeout: seconds to wait for proxy port
         :return: ip
         """
+        ip = self.node.public_ips[0]
+        self.session = self.get_session(ip)
+        self.wait_ready(ip, timeout=timeout)
+        log.info(f" {ip} adopted")
+        return ip
 
-        # launch server. ubuntu.
-        name = names.sample(1).item().lower()
-        size = [s for s in self.lc.list_sizes() if s.name == "t3.nano"][0]
-        image = self.lc.list_images(ex_image_ids=["ami-03d8261f577d71b6a"])[0]
-        node = self.lc.create_node(
-            name,
+    def create_nodes(self, n=1):
+        """ create n nodes and wait until running
+        :return: list of nodes
+        """
+        size, image = get_size_image(self.lc, self.size, self.image)
+        kwargs = dict()
+        if self.bootstrap == "userdata":
+            kwargs["ex_userdata"] = get_userdata()
+        nodes = self.lc.create_node(
+            self.name,
             size,
             image,
             ex_keyname="key",
-            ex_spot=True,
+            ex_spot=self.spot,
             ex_security_groups=["proxy"],
             ex_metadata=dict(app="proxy", ready=False),
+            ex_mincount=n,
+            ex_maxcount=n,
+            **kwargs,
         )
-        log.info(f"waiting for {name} to start")
-        node = self.lc.wait_until_running([node])[0][0]
-        self.node = node
+        if not isinstance(nodes, list):
+            nodes = [nodes]
+        log.info(f"waiting for {n} nodes to start")
+        return [node for node, ips in self.lc.wait_until_running(nodes)]
+
+    def start(self):
+        """ start node
+        :return: ip
+        """
+        self.node = self.create_nodes(1)[0]
+        return self.configure()
+
+    def configure(self):
+        """ configure running node as proxy
+        :return: ip
+        """
+        node = self.node
         ip = node.public_ips[0]
         self.session = self.get_session(ip)
+        if self.bootstrap == "ssh":
+            self.install(ip)
+
+        # wait for proxy to be working
+        try:
+            self.wait_ready(ip)
+        except:
+            log.error(f"Failed to start proxy for {node.extra.instance_id} at {ip}")
+            raise
+
+        # make available. batch launch gives all nodes the same name so rename.
+        self.lc.ex_create_tags(node, dict(Name=self.name, ready="True"))
+        log.info(f" {ip} started")
+
+        return ip
+
+    def rotate(self):
+        """ change public ip of node
+        :return: new ip
+        """
+        if self.rotate_mode == "eip":
+            old = self.eip
+            self.eip = self.lc.ex_allocate_address(domain="vpc")
+            # replaces association of previous ip
+            association = self.lc.ex_associate_address_with_node(
+                self.node, self.eip, domain="vpc"
+            )
+            # allocated address has no association id. needed to disassociate on stop.
+            self.eip.extra["association_id"] = association
+            if old is not None:
+                self.lc.ex_release_address(old, domain="vpc")
+            ip = self.eip.ip
+        else:
+            self.lc.ex_stop_node(self.node)
+            Retry(tries=60, delay=2, warn=1)(self.check_state)(NodeState.STOPPED)
+            self.lc.ex_start_node(self.node)
+            self.node = self.lc.wait_until_running([self.node])[0][0]
+            ip = self.node.public_ips[0]
+
+        self.session.close()
+        self.session = self.get_session(ip)
+        self.wait_ready(ip, timeout=60)
+        log.info(f"rotated {self.name} to {ip}")
+        return ip
+
+    def check_state(self, state):
+        """ raise exception if node not in state """
+        node = [n for n in self.lc.list_nodes() if n.id == self.node.id][0]
+        if node.state != state:
+            raise Exception(f"{self.name} is {node.state}")
+
+    def stop(self):
+        if self.eip is None:
+            super().stop()
+            return
+        self.lc.ex_disassociate_address(self.eip, domain="vpc")
+        super().stop()
+        self.lc.ex_release_address(self.eip, domain="vpc")
+
+    def install(self, ip):
+        """ install tinyproxy using fabric """
+        # fabric is slow to import and only needed for bootstrap=ssh
+        from fabric import Connection
 
-        # configure using fabric
         con = Connection(
             ip, user="ubuntu", connect_kwargs=dict(key_filename=f"{HOME}/.aws/key"),
         )
@@ -91,15 +333,25 @@ class AWS(Proxy):
             hide="both",
         )
 
-        # wait for proxy to be working
+    @classmethod
+    def bake(cls, name="mproxy-tinyproxy", **params):
+        """ create ami with tinyproxy installed. use with AWS(bootstrap="ami", image=ami)
+        :param name: image name
+        :param params: passed to AWS()
+        :return: ami id
+        """
+        proxy = cls(**params)
+        proxy.start()
         try:
-            self.check_proxy()
-        except:
-            log.error(f"Failed to start proxy for {node.extra.instance_id} at {ip}")
-            raise
+            image = proxy.lc.create_image(proxy.node, name)
+            Retry(tries=60, delay=10, warn=1)(proxy.check_image)(image.id)
+        finally:
+            proxy.stop()
+        log.info(f"created {image.id}")
+        return image.id
 
-        # make available
-        self.lc.ex_create_tags(node, dict(ready="True"))
-        log.info(f" {ip} started")
-
-        return ip
+    def check_image(self, image_id):
+        """ raise exception if image not available """
+        image = self.lc.get_image(image_id)
+        if image.extra.get("state") != "available":
+            raise Exception(f"{image_id} is {image.extra.get('state')}")
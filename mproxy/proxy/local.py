@@ -0,0 +1,145 @@
+import http.client
+import logging
+import selectors
+import socket
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from itertools import count
+from threading import Thread
+from urllib.parse import urlsplit
+
+from .proxy import Proxy
+
+log = logging.getLogger(__name__)
+
+# headers that apply to one connection and are not forwarded
+HOP = {
+    "connection",
+    "keep-alive",
+    "proxy-authorization",
+    "proxy-connection",
+    "te",
+    "trailer",
+    "transfer-encoding",
+    "upgrade",
+}
+
+# last octet of next loopback address
+addresses = count(2)
+
+
+class Handler(BaseHTTPRequestHandler):
+    """ forward proxy request handler. outgoing connections use the proxy ip """
+
+    protocol_version = "HTTP/1.1"
+
+    def do_CONNECT(self):
+        host, port = self.path.rsplit(":", 1)
+        try:
+            upstream = socket.create_connection(
+                (host, int(port)), timeout=30, source_address=(self.server.ip, 0)
+            )
+        except OSError:
+            self.send_error(502)
+            return
+        self.send_response(200, "Connection established")
+        self.end_headers()
+        self.relay(upstream)
+        self.close_connection = True
+
+    def relay(self, upstream):
+        """ copy bytes both ways until either side closes """
+        sel = selectors.DefaultSelector()
+        sel.register(self.connection, selectors.EVENT_READ, upstream)
+        sel.register(upstream, selectors.EVENT_READ, self.connection)
+        try:
+            while True:
+                for key, _ in sel.select(timeout=60):
+                    data = key.fileobj.recv(65536)
+                    if not data:
+                        return
+                    key.data.sendall(data)
+        except OSError:
+            pass
+        finally:
+            sel.close()
+            upstream.close()
+
+    def forward(self):
+        url = urlsplit(self.path)
+        con = http.client.HTTPConnection(
+            url.hostname,
+            url.port or 80,
+            timeout=30,
+            source_address=(self.server.ip, 0),
+        )
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length) if length else None
+        headers = {k: v for k, v in self.headers.items() if k.lower() not in HOP}
+        path = f"{url.path or '/'}?{url.query}" if url.query else url.path or "/"
+        try:
+            con.request(self.command, path, body, headers)
+            r = con.getresponse()
+            data = r.read()
+        except OSError:
+            self.send_error(502)
+            return
+        finally:
+            con.close()
+        self.send_response(r.status, r.reason)
+        for k, v in r.getheaders():
+            if k.lower() not in HOP and k.lower() != "content-length":
+                self.send_header(k, v)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    do_GET = forward
+    do_POST = forward
+    do_HEAD = forward
+
+    def log_message(self, *args):
+        pass
+
+
+class Server(ThreadingHTTPServer):
+    # default backlog of 5 drops connections under load
+    request_queue_size = 128
+    daemon_threads = True
+
+
+class Local(Proxy):
+    """ in-process forward proxy on a loopback address for tests and benchmarks
+
+    Each proxy gets its own address 127.0.0.n so the Manager can tell them apart and
+    servers see a different client ip per proxy. Loopback addresses other than
+    127.0.0.1 need configuring on macos and windows.
+    """
+
+    def __init__(self, ip=None):
+        """
+        :param ip: loopback address. None for next unused.
+        """
+        super().__init__()
+        self.ip = ip or f"127.0.0.{next(addresses)}"
+        self.server = None
+
+    def start(self):
+        self.server = Server((self.ip, 0), Handler)
+        self.server.ip = self.ip
+        self.port = self.server.server_address[1]
+        # short poll so stop is quick when replacing blocked proxies
+        Thread(
+            target=self.server.serve_forever,
+            args=(0.05,),
+            daemon=True,
+            name=f"local proxy {self.ip}:{self.port}",
+        ).start()
+        self.session = self.get_session(self.ip)
+        # tunnel https with CONNECT rather than tls to the proxy
+        self.session.proxies["https"] = self.session.proxies["http"]
+        return self.ip
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.session.close()
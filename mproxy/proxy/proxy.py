@@ -1,61 +1,302 @@
+import csv
 import logging
 import os
+import random
+import socket
+from functools import lru_cache
 from os.path import expanduser
+from threading import Lock, local
+from time import monotonic, perf_counter, sleep
+from weakref import WeakSet
 
-import pandas as pd
 import requests
 
-from ..utils import Retry
+from .. import detect
+from ..metrics import ProxyMetrics
+from ..proxysession import ProxyException
+from ..utils.ratelimit import RateLimiter
 
 log = logging.getLogger(__name__)
 
 HOME = expanduser("~").replace("\\", "/")
 HERE = os.path.dirname(__file__)
-names = pd.read_csv(f"{HERE}/babies-first-names-top-100-girls.csv").FirstForename
 ua = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/83.0.4103.97 Safari/537.36"
 
 
+@lru_cache()
+def get_names():
+    """ return first names used to name nodes. read on first use. """
+    with open(f"{HERE}/babies-first-names-top-100-girls.csv", newline="") as f:
+        return [row["FirstForename"] for row in csv.DictReader(f)]
+
+
+def get_name():
+    """ return random lower case name """
+    return random.choice(get_names()).lower()
+
+
+class Session(requests.Session):
+    """ requests session that paces requests and records timing and errors on its proxy """
+
+    def __init__(self, proxy):
+        super().__init__()
+        self.proxy = proxy
+
+    def __setstate__(self, state):
+        # requests pickles only its own attributes e.g. create_client().get_session().
+        # proxy stats and limiter stay in the server process.
+        super().__setstate__(state)
+        self.proxy = None
+
+    def request(self, method, url, *args, **kwargs):
+        if self.proxy is None:
+            return super().request(method, url, *args, **kwargs)
+        self.proxy.limiter.wait(url)
+        self.proxy.begin()
+        start = perf_counter()
+        try:
+            r = super().request(method, url, *args, **kwargs)
+        except requests.exceptions.ProxyError as e:
+            # proxy stopped or unreachable
+            self.proxy.record(perf_counter() - start, error=True)
+            raise ProxyException(str(e)) from e
+        except Exception:
+            self.proxy.record(perf_counter() - start, error=True)
+            raise
+        stream = kwargs.get("stream")
+        self.proxy.record(
+            perf_counter() - start,
+            error=r.status_code >= 400,
+            status=r.status_code,
+            size=int(r.headers.get("Content-Length", 0)) if stream else len(r.content),
+        )
+        # streamed body is left for the caller
+        detect.screen(
+            self.proxy,
+            r.url,
+            r.status_code,
+            r.headers,
+            None if stream else lambda: r.text,
+        )
+        return r
+
+
 class Proxy:
     """ base class for proxy
     """
 
+    # weight of latest request in latency and error averages
+    alpha = 0.3
+
+    # proxy server port
+    port = 8888
+
+    # True if rotate() can change ip without replacing the proxy
+    rotates = False
+
+    # HTTPAdapter settings. pool_maxsize is connections kept alive per host; with
+    # pool_block=True it also caps concurrent requests. Manager(pool=...) overrides.
+    pool = dict(pool_connections=10, pool_maxsize=10, pool_block=False)
+
     def __init__(self):
         self.node = None
         self.lc = None
         self.con = None
-        self.counter = 0
         self.session = None
 
+        # constructor params. Manager passes them to replacements of this proxy.
+        self.params = dict()
+
+        # request stats used by selection strategies
+        self.counter = 0
+        self.outstanding = 0
+        self.latency = None
+        self.errors = 0.0
+        self.stats_lock = Lock()
+        self.metrics = ProxyMetrics()
+
+        # suspected blocks in a row and counter at the last one
+        self.suspects = 0
+        self.last_suspect = 0
+
+        # paces requests per domain. Manager replaces with configured rates.
+        self.limiter = RateLimiter()
+
+        # copies of session for each thread when Manager(per_thread=True)
+        self.local = local()
+        self.thread_sessions = WeakSet()
+
     def get(self, query, params=None):
         """ return response to request """
-        r = self.session.get(query, params=params)
-        self.counter += 1
-        return r
+        return self.session.get(query, params=params)
+
+    def begin(self):
+        """ record start of request """
+        with self.stats_lock:
+            self.outstanding += 1
+
+    def record(self, elapsed, error=False, status=None, size=0):
+        """ record end of request
+        :param elapsed: seconds taken
+        :param error: True if failed or blocked
+        :param status: http status code. None if no response.
+        :param size: response bytes
+        """
+        with self.stats_lock:
+            self.metrics.observe(elapsed, error, status, size)
+            self.outstanding = max(self.outstanding - 1, 0)
+            self.counter += 1
+            a = self.alpha
+            self.latency = (
+                elapsed if self.latency is None else a * elapsed + (1 - a) * self.latency
+            )
+            self.errors = a * error + (1 - a) * self.errors
+
+    def fail(self, soft=False):
+        """ record block found after the response was received e.g. by source function
+        :param soft: suspected block e.g. empty results. lowers weight without a block.
+        :return: suspected blocks in a row. one clean request between them is allowed.
+        """
+        with self.stats_lock:
+            self.errors = self.alpha + (1 - self.alpha) * self.errors
+            if not soft:
+                self.metrics.blocks += 1
+                return self.suspects
+            if self.counter - self.last_suspect > 2:
+                self.suspects = 0
+            self.suspects += 1
+            self.last_suspect = self.counter
+            self.metrics.suspects += 1
+            return self.suspects
+
+    def snapshot(self):
+        """ return dict of metrics """
+        with self.stats_lock:
+            return dict(
+                self.metrics.snapshot(),
+                outstanding=self.outstanding,
+                latency_ewma=self.latency,
+                error_rate=self.errors,
+                waits=self.limiter.stats(),
+                pool=self.pool_stats(),
+            )
 
     def get_session(self, ip):
         """ get session with proxies and retries """
-        s = requests.session()
-        adapter = requests.adapters.HTTPAdapter(max_retries=3)
-        s.mount("http://", adapter)
-        s.mount("https://", adapter)
+        s = Session(self)
+        self.mount(s)
         s.headers = {"User-Agent": ua}
-        proxy = f"{ip}:8888"
+        proxy = f"{ip}:{self.port}"
         s.proxies = dict(http=f"http://{proxy}", https=f"https://{proxy}")
         s.trust_env = False
         return s
 
+    def mount(self, s):
+        """ mount adapter with pool settings on session """
+        adapter = requests.adapters.HTTPAdapter(max_retries=3, **self.pool)
+        s.mount("http://", adapter)
+        s.mount("https://", adapter)
+
+    def thread_session(self):
+        """ return copy of session for current thread
+
+        requests sessions are not guaranteed thread safe. each thread gets its own
+        connection pool to the proxy; copies are remade when self.session changes
+        e.g. after rotate.
+        """
+        base = self.session
+        if getattr(self.local, "base", None) is not base:
+            s = Session(self)
+            self.mount(s)
+            s.headers = requests.structures.CaseInsensitiveDict(base.headers)
+            s.proxies = dict(base.proxies)
+            s.auth = base.auth
+            s.trust_env = base.trust_env
+            old = getattr(self.local, "session", None)
+            if old is not None:
+                old.close()
+            self.local.base = base
+            self.local.session = s
+            self.thread_sessions.add(s)
+        return self.local.session
+
+    def close_sessions(self):
+        """ close thread sessions """
+        for s in list(self.thread_sessions):
+            s.close()
+
+    def pool_stats(self):
+        """ return connection reuse across sessions
+        :return: dict(connections=opened, requests=sent, reuse=fraction of requests on
+            an existing connection, idle=connections waiting in pools)
+        """
+        connections = sent = idle = 0
+        sessions = [self.session, *list(self.thread_sessions)]
+        adapters = {
+            id(a): a for s in sessions if s is not None for a in s.adapters.values()
+        }
+        for adapter in adapters.values():
+            managers = [adapter.poolmanager, *list(adapter.proxy_manager.values())]
+            for manager in managers:
+                for key in manager.pools.keys():
+                    pool = manager.pools.get(key)
+                    if pool is None:
+                        continue
+                    connections += pool.num_connections
+                    sent += pool.num_requests
+                    if pool.pool is not None:
+                        # queue is padded with None for connections not yet opened
+                        idle += sum(c is not None for c in list(pool.pool.queue))
+        return dict(
+            connections=connections,
+            requests=sent,
+            reuse=1 - connections / sent if sent else None,
+            idle=idle,
+        )
+
     def start(self):
         """ initialise the proxy provider e.g. start server """
         raise NotImplementedError
 
+    def rotate(self):
+        """ change ip of running proxy
+        :return: new ip
+        """
+        raise NotImplementedError
+
     def stop(self):
-        self.lc.ex_create_tags(self.node, dict(ready="False", name=""))
-        self.con.close()
-        self.session.close()
-        self.node.destroy()
-
-    @Retry(tries=5, delay=1, warn=1)
-    def check_proxy(self):
-        """ wait for proxy ready """
-        r = self.get("http://api.ipify.org")
-        r.raise_for_status()
+        # discovered proxies that were never adopted have no session
+        if self.node is not None:
+            self.lc.ex_create_tags(self.node, dict(ready="False", name=""))
+        if self.con:
+            self.con.close()
+        if self.session is not None:
+            self.session.close()
+        if self.node is not None:
+            self.node.destroy()
+
+    def wait_ready(self, ip, timeout=300, interval=0.25):
+        """ wait for proxy port to accept connections then for a request to succeed
+        :param timeout: seconds to wait for port and request
+        :param interval: seconds between connection attempts
+        """
+        end = monotonic() + timeout
+        while True:
+            try:
+                socket.create_connection((ip, self.port), timeout=interval).close()
+                break
+            except OSError:
+                if monotonic() > end:
+                    raise TimeoutError(f"{ip}:{self.port} not open after {timeout}s")
+                sleep(interval)
+        # port may open before the proxy is configured e.g. stock tinyproxy returns 403
+        while True:
+            try:
+                r = self.get("http://api.ipify.org")
+                r.raise_for_status()
+                return
+            except (requests.RequestException, ProxyException):
+                # ProxyException when the port drops connections e.g. during restart
+                if monotonic() > end:
+                    raise
+                sleep(max(interval, 1))
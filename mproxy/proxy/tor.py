@@ -1,29 +1,85 @@
+import logging
 from pathlib import Path
+from threading import Lock
+from time import sleep
+from uuid import uuid4
 
 from stem import Signal
-from stem.connection import connect
+from stem.control import Controller
 
 from .proxy import Proxy
 
-with (Path.home() / ".tor/creds").open() as f:
-    password = f.read()
+log = logging.getLogger(__name__)
+
+# one NEWNYM at a time as tor accepts one every 10 seconds
+newnym_lock = Lock()
+
+
+def newnym(port=9051):
+    """ expire all tor circuits e.g. when every exit is blocked
+
+    Tor ignores NEWNYM sent within 10 seconds of the last one so this waits until it is
+    accepted. Tor.rotate renews a single circuit without NEWNYM.
+
+    :param port: tor control port. password is read from ~/.tor/creds
+    """
+    with (Path.home() / ".tor/creds").open() as f:
+        password = f.read().strip()
+    with newnym_lock, Controller.from_port(port=port) as controller:
+        controller.authenticate(password=password)
+        wait = controller.get_newnym_wait()
+        if wait > 0:
+            log.info(f"waiting {wait:.1f}s for tor to accept NEWNYM")
+            sleep(wait)
+        controller.signal(Signal.NEWNYM)
 
 
 class Tor(Proxy):
-    """ proxy using tor
+    """ proxy using a tor circuit
     Note many websites block tor ip addresses making it useless as a proxy server
     e.g. google search
+
+    Each Tor proxy is a separate circuit. Tor isolates streams by socks credentials
+    (IsolateSOCKSAuth is on by default) so each proxy uses its own username on the
+    shared SocksPort. Pass port to spread proxies across several SocksPorts. Requests
+    need pysocks e.g. pip install requests[socks].
     """
 
+    # rotate() switches to a new circuit
+    rotates = True
+
+    def __init__(self, host="localhost", port=9050):
+        """
+        :param host: tor host
+        :param port: tor SocksPort
+        """
+        super().__init__()
+        self.host = host
+        self.port = port
+        self.user = None
+
     def start(self):
-        # force new ip address
-        controller = connect()
-        controller.authenticate(password=password)
-        controller.signal("NEWNYM")
-        ip = "socks5://localhost:9050"
-        self.session = self.get_session(ip)
-        self.session.proxies = dict(http=ip, https=ip)
-        return "localhost"
+        """ start circuit
+        :return: key user@host that identifies the circuit in the Manager
+        """
+        return self._circuit()
+
+    def rotate(self):
+        """ switch to a new circuit. other circuits are unaffected.
+        :return: key for new circuit
+        """
+        self.session.close()
+        return self._circuit()
+
+    def _circuit(self):
+        """ create session with new socks credentials so tor builds a new circuit """
+        # random so other processes and later runs never share a circuit
+        self.user = f"mproxy{uuid4().hex}"
+        # socks5h resolves dns via tor
+        url = f"socks5h://{self.user}:x@{self.host}:{self.port}"
+        self.session = self.get_session(self.host)
+        self.session.proxies = dict(http=url, https=url)
+        return f"{self.user}@{self.host}"
 
     def stop(self):
-        pass
+        self.session.close()
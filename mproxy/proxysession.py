@@ -3,8 +3,8 @@ from functools import wraps
 from .utils import Retry
 
 
-class ProxyException(BaseException):
-    """ source get function raises this when proxy is blocked """
+class ProxyException(Exception):
+    """ source get function or block detection raises this when proxy is blocked """
 
     pass
 
@@ -21,14 +21,23 @@ class ProxySession:
         return getattr(self.session, attr)
 
     def get_proxy_function(self, func, tries=2):
-        """ wrap function with ProxyException handler """
-
-        @Retry(tries=tries, exceptions=ProxyException, warn=0)
+        """ wrap function with ProxyException handler. retries immediately on a new proxy
+        within the manager retry budget.
+        """
+
+        @Retry(
+            tries=tries,
+            delay=0,
+            exceptions=ProxyException,
+            warn=0,
+            budget=getattr(self.manager, "budget", None),
+        )
         @wraps(func)
         def inner(*args, **kwargs):
             try:
                 return func(self.session, *args, **kwargs)
             except ProxyException:
+                self.session.proxy.fail()
                 self.replace()
                 raise
 
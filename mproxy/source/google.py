@@ -1,14 +1,46 @@
+import json
 import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from urllib.parse import parse_qs, urlparse
+from functools import wraps
+from inspect import iscoroutinefunction, signature
+from urllib.parse import parse_qs, urlparse, urlsplit
 
+import lxml.html
 import requests
-from bs4 import BeautifulSoup
 
+from .. import detect
+from ..batch import Batch
+from ..detect import Rule
 from ..proxysession import ProxyException
+from ..utils.cache import Cache
 
 log = logging.getLogger(__name__)
 
+# requests per second and burst per proxy for Manager(rates=google.rates).
+# starting point to tune just below the block threshold.
+rates = {"google.com": (0.2, 3)}
+
+# must be https to include date search. bench/fakegoogle.py replaces for load tests.
+URL = "https://google.com"
+
+# results cache used by search functions. set with set_cache.
+cache = None
+
+# block signatures screened by proxy sessions. register for other hosts e.g. fakegoogle
+rules = [
+    Rule("sorry", url=r"/sorry/"),
+    # the interstitial form. queries echoed in the page have their quotes escaped.
+    Rule("captcha", body=r"<form[^>]+action=[\"'][^\"']*/sorry/index"),
+    Rule("blocked", status=[403, 429, 503]),
+]
+detect.register("google.com", *rules)
+
+# dict(language=page text when a search genuinely has no results). empty pages in other
+# languages are not treated as suspected blocks.
+NO_RESULTS = {"en": "did not match any documents"}
+
 
 class Stypes:
     """ types of results required """
@@ -21,8 +53,7 @@ class Stypes:
     apps = "app"
 
 
-def search(
-    session,
+def get_params(
     query,
     n=99,
     start=1,
@@ -33,23 +64,12 @@ def search(
     stype="",
     **kwargs,
 ):
-    """ search google and return list of urls
-    :param query: search string
-    :param n: number of results. 99/page so 100 returns 198.
-    :param start: index of first result
-    :param lang: language
-    :param after: YYYYMMDD; YYYY-MM-DD; python date
-    :param before: YYYYMMDD; YYYY-MM-DD; python date
-    :param site: e.g. www.guardian.co.uk
-    :param stype: from search.Stypes. type of search e.g. video
-    :return: list of urls
-
-    searches are location specific based on ip address (google ignores tld and country)
-    can change location in settings but this is encrypted so unclear how to encode
-    """
+    """ return path and params for first page of search. see search for parameters """
 
     def get_date(d):
         """ allow yyyymmdd or yyyy-mm-dd or datetime"""
+        if not d:
+            return d
         if isinstance(d, str):
             if "-" in d:
                 d = datetime.strptime(d, "%Y-%m-%d")
@@ -70,34 +90,257 @@ def search(
     # results per page=num-1. maximum num=100 which returns up to 99 results.
     path = "/search"
     params = dict(q=query, hl=lang, tbm=stype, start=start, num=min(n, 100), **kwargs)
+    return path, params
+
+
+def get_key(query, n=99, **kwargs):
+    """ return cache key for search. see search for parameters """
+    path, params = get_params(" ".join(query.lower().split()), n, **kwargs)
+    params = {k: v for k, v in params.items() if v not in (None, "")}
+    params["hl"] = params.get("hl", "").lower()
+    params["n"] = n
+    return json.dumps(params, sort_keys=True, default=str)
+
+
+def set_cache(path="google.db", ttl=7 * 86400, maxsize=100000):
+    """ cache search results. None to disable.
+    :param path: sqlite file
+    :param ttl: seconds before results expire
+    :param maxsize: number of searches kept
+    :return: Cache. cache.stats() gives hits and misses.
+    """
+    global cache
+    cache = None if path is None else Cache(path, ttl=ttl, maxsize=maxsize)
+    return cache
+
+
+def cached(*exclude):
+    """ decorator that serves search results from cache without using a proxy
+    :param exclude: keyword arguments that are not search parameters
+
+    empty results are not cached as they may be an undetected block
+    """
+
+    def decorator(func):
+        default_n = signature(func).parameters["n"].default
+
+        def get(query, n, kwargs):
+            """ return key and cached urls """
+            if cache is None:
+                return None, None
+            params = {k: v for k, v in kwargs.items() if k not in exclude}
+            key = get_key(query, n, **params)
+            return key, cache.get(key)
+
+        if iscoroutinefunction(func):
+
+            @wraps(func)
+            async def inner(session, query, n=default_n, **kwargs):
+                key, urls = get(query, n, kwargs)
+                if urls is None:
+                    urls = await func(session, query, n, **kwargs)
+                    if key is not None and urls:
+                        cache.set(key, urls)
+                return urls
+
+        else:
+
+            @wraps(func)
+            def inner(session, query, n=default_n, **kwargs):
+                key, urls = get(query, n, kwargs)
+                if urls is None:
+                    urls = func(session, query, n, **kwargs)
+                    if key is not None and urls:
+                        cache.set(key, urls)
+                return urls
+
+        return inner
+
+    return decorator
+
+
+@cached()
+def search(session, query, n=99, **kwargs):
+    """ search google and return list of urls
+    :param query: search string
+    :param n: number of results. 99/page so 100 returns 198.
+    :param start: index of first result
+    :param lang: language
+    :param after: YYYYMMDD; YYYY-MM-DD; python date
+    :param before: YYYYMMDD; YYYY-MM-DD; python date
+    :param site: e.g. www.guardian.co.uk
+    :param stype: from search.Stypes. type of search e.g. video
+    :return: list of urls
+
+    searches are location specific based on ip address (google ignores tld and country)
+    can change location in settings but this is encrypted so unclear how to encode
+    """
+    return list(isearch(session, query, n, **kwargs))
+
+
+def isearch(session, query, n=99, **kwargs):
+    """ generator version of search that yields urls as each page is parsed
+
+    next page is only fetched when the caller asks for more urls so stopping early
+    e.g. with itertools.islice saves page requests. see search for parameters.
+    """
+    path, params = get_params(query, n, **kwargs)
+    lang = params["hl"]
 
     # iterate pages
-    urls = []
+    count = 0
     while True:
-        # get page. must be https to include date search.
-        r = session.get(f"https://google.com{path}", params=params)
+        # get page
+        r = session.get(f"{URL}{path}", params=params)
         log.debug(r.url)
         if r.status_code != 200:
             raise ProxyException
 
         # extract urls from page
-        soup = BeautifulSoup(r.text, "lxml")
-        urls.extend(extract_urls(soup))
+        page_urls, path = parse_page(r.text)
+        if not count and not page_urls:
+            check_empty(session, r.text, lang)
+        yield from page_urls
 
         # next page
-        if len(urls) >= n:
-            break
-        path = None
+        count += len(page_urls)
+        if count >= n or not path:
+            return
         params = None
-        try:
-            path = soup.find(id="pnnext").get("href")
-        except:
+
+
+@cached()
+async def asearch(session, query, n=99, **kwargs):
+    """ async version of search for use with AsyncManager sessions. see search for parameters
+    :return: list of urls
+    """
+    path, params = get_params(query, n, **kwargs)
+    lang = params["hl"]
+
+    urls = []
+    while True:
+        r = await session.get(f"{URL}{path}", params=params)
+        log.debug(r.url)
+        if r.status != 200:
+            raise ProxyException
+
+        text = await r.text()
+        page_urls, path = parse_page(text)
+        if not urls and not page_urls:
+            check_empty(session, text, lang)
+        urls.extend(page_urls)
+
+        if len(urls) >= n or not path:
             break
+        params = None
     return list(urls)
 
 
+@cached("workers", "tries")
+def search_parallel(manager, query, n=990, workers=None, tries=2, **kwargs):
+    """ search google fetching pages concurrently each via a different proxy
+    :param manager: Manager
+    :param n: number of results
+    :param workers: maximum pages in flight. None is one per proxy.
+    :param tries: proxies to try per page before raising ProxyException
+    :return: list of urls in page order. see search for other parameters.
+
+    stops early when a page has no results or no next page
+    """
+    path, params = get_params(query, n, **kwargs)
+    num = params["num"]
+    pages = -(-n // max(num - 1, 1))
+    workers = min(workers or max(len(manager.proxies), 1), pages)
+
+    def get_page(i):
+        """ return urls and next path for page i """
+        page_params = dict(params, start=params["start"] + i * num)
+        for _ in range(tries):
+            session = manager.get_session()
+            try:
+                r = session.get(f"{URL}{path}", params=page_params)
+                log.debug(r.url)
+                if r.status_code == 200:
+                    return parse_page(r.text)
+            except ProxyException:
+                pass
+            session.proxy.fail()
+            manager.block(session.proxies["http"])
+        raise ProxyException
+
+    urls = []
+    with ThreadPoolExecutor(workers) as executor:
+        futures = deque(executor.submit(get_page, i) for i in range(workers))
+        submitted = workers
+        try:
+            while futures:
+                page_urls, next_path = futures.popleft().result()
+                urls.extend(page_urls)
+                if not page_urls or not next_path:
+                    break
+                if submitted < pages:
+                    futures.append(executor.submit(get_page, submitted))
+                    submitted += 1
+        finally:
+            for future in futures:
+                future.cancel()
+    return list(dict.fromkeys(urls))
+
+
+def search_many(manager, queries, per_proxy=2, tries=2, **kwargs):
+    """ search many queries across the proxy pool
+    :param manager: Manager
+    :param queries: iterable of search strings
+    :param per_proxy: searches in flight per proxy
+    :param tries: proxies to try per query
+    :param kwargs: passed to search
+    :return: Batch. iterate for (query, urls) as completed. batch.stats() for throughput.
+    """
+    return Batch(manager, search, queries, per_proxy=per_proxy, tries=tries, **kwargs)
+
+
+def check_empty(session, html, lang="en"):
+    """ first page with no results and no "no results" message is a suspected block
+    :param lang: hl of search. languages without a known message are not checked.
+    :raises ProxyException: after several suspected blocks in a row
+    """
+    message = NO_RESULTS.get((lang or "en").split("-")[0].lower())
+    if message is None or message in html:
+        return
+    # plain requests session has no proxy to down weight
+    proxy = getattr(session, "proxy", None)
+    if proxy is None:
+        log.info("empty results. possible block.")
+        return
+    detect.soft(proxy, "empty results")
+
+
+def parse_page(html):
+    """ return urls and path to next page (None if last page) """
+    if not html.strip():
+        return [], None
+    tree = lxml.html.fromstring(html)
+    path = tree.xpath('//*[@id="pnnext"]/@href')
+    return extract_urls_fast(tree.xpath("//a/@href")), path[0] if path else None
+
+
+def extract_urls_fast(hrefs):
+    """ return search result urls from list of link hrefs. same result as extract_urls """
+    urls = []
+    for url in hrefs:
+        if not url:
+            continue
+        if url.startswith("/url?"):
+            url = parse_qs(urlsplit(url).query)["q"][0]
+        netloc = urlsplit(url, "http").netloc
+        if netloc and "google" not in netloc:
+            urls.append(url)
+    # dedupe
+    return list(dict.fromkeys(urls))
+
+
 def extract_urls(soup):
-    """ return search result urls from page """
+    """ return search result urls from BeautifulSoup page. slower than extract_urls_fast """
     urls = []
     links = soup.findAll("a")
     for link in links:
@@ -1,70 +1,245 @@
-import json
+"""
+google translate via rotating proxies. many texts are translated in few requests.
+
+Usage::
+
+    from mproxy.source import translate
+
+    translate.set_cache("translate.db")
+    m = Manager(rates=translate.rates)
+    m.add(AWS, 4)
+    results = translate.translate_many(m, texts, src="de", dest="en")
+
+Texts are grouped into chunks of up to SIZE characters that are sent as one request.
+Chunks are spread over the pool with Batch. Each proxy keeps one Translator so google
+sees a consistent client rather than switches between requests.
+"""
 import logging
+from hashlib import sha1
+from threading import Lock
+from weakref import WeakKeyDictionary
 
 import requests
 from googletrans import Translator
 
+from ..batch import Batch
+from ..proxy.proxy import Session
+from ..proxysession import ProxyException
+from ..utils.cache import Cache
+
 log = logging.getLogger(__name__)
 
+# requests per second and burst per proxy for Manager(rates=translate.rates)
+rates = {"translate.google.com": (0.5, 2)}
+
+# characters per request. google rejects more than 5000.
+SIZE = 4500
+
+# joins texts in a chunk. texts containing it are sent alone.
+SEP = "\n"
+
+# seconds per translate request
+TIMEOUT = 7
+
+# translation cache. set with set_cache.
+cache = None
+
+# dict(proxy=Translator). one per proxy so the token and cookies stay with one ip.
+translators = WeakKeyDictionary()
+translators_lock = Lock()
+
+# translator without proxy
+direct = None
+
+
+def set_cache(path="translate.db", ttl=None, maxsize=1000000):
+    """ cache translations. None to disable.
+    :param path: sqlite file
+    :param ttl: seconds before translations expire. None never expires.
+    :param maxsize: number of translations kept
+    :return: Cache. cache.stats() gives hits and misses.
+    """
+    global cache
+    cache = None if path is None else Cache(path, ttl=ttl, maxsize=maxsize)
+    return cache
+
+
+def get_key(text, src, dest):
+    """ return cache key for translation """
+    return f"{sha1(text.encode()).hexdigest()}:{src}:{dest}"
+
+
+class TimeoutAdapter(requests.adapters.HTTPAdapter):
+    """ adapter with a default timeout for requests sent without one """
+
+    def __init__(self, timeout=TIMEOUT, **kwargs):
+        self.timeout = timeout
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = self.timeout
+        return super().send(request, **kwargs)
+
+
+def get_session(session):
+    """ return copy of proxy session with a timeout on every request
+    :param session: proxy session. the translator copy paces and records on its proxy.
+    """
+    proxy = session.proxy
+    s = Session(proxy)
+    adapter = TimeoutAdapter(TIMEOUT, max_retries=3, **proxy.pool)
+    s.mount("http://", adapter)
+    s.mount("https://", adapter)
+    s.headers = requests.structures.CaseInsensitiveDict(session.headers)
+    s.proxies = dict(session.proxies)
+    s.auth = session.auth
+    s.trust_env = session.trust_env
+    return s
+
+
+def get_translator(session):
+    """ return translator that sends requests via session. one per proxy.
+    :param session: proxy session. None for no proxy.
+    """
+    global direct
+    with translators_lock:
+        if session is None:
+            if direct is None:
+                direct = Translator(timeout=TIMEOUT)
+            return direct
+        translator = translators.get(session.proxy)
+        # proxy session changes when a proxy rotates
+        if translator is None or translator.base is not session:
+            translator = Translator(timeout=TIMEOUT)
+            # translator passes its session to the token acquirer so replace both.
+            # replacing drops the timeout googletrans mounted so the copy has its own.
+            s = get_session(session)
+            translator.session = s
+            translator.token_acquirer.session = s
+            translator.base = session
+            translators[session.proxy] = translator
+        return translator
+
+
+def chunk(texts, size=SIZE):
+    """ group texts into chunks sent as one request
+    :param texts: list of texts
+    :param size: maximum characters per chunk. longer texts are sent alone.
+    :return: list of tuples of texts
+    """
+    chunks = []
+    current = []
+    length = 0
+    for text in texts:
+        if SEP in text or len(text) >= size:
+            chunks.append((text,))
+            continue
+        if current and length + len(SEP) + len(text) > size:
+            chunks.append(tuple(current))
+            current = []
+            length = 0
+        length += len(text) + (len(SEP) if current else 0)
+        current.append(text)
+    if current:
+        chunks.append(tuple(current))
+    return chunks
+
+
+def translate(session, texts, src="auto", dest="en"):
+    """ translate a chunk of texts in one request
+    :param session: proxy session. None for no proxy.
+    :param texts: tuple of texts from chunk
+    :return: list of translations
+    """
+    translator = get_translator(session)
+    try:
+        result = translator.translate(SEP.join(texts), src=src, dest=dest).text
+        if len(texts) == 1:
+            # text sent alone may contain SEP
+            return [result]
+        lines = result.split(SEP)
+        if len(lines) != len(texts):
+            # google merged or split lines so translate separately
+            log.info(f"chunk of {len(texts)} returned {len(lines)} lines")
+            translated = translator.translate(list(texts), src=src, dest=dest)
+            lines = [t.text for t in translated]
+    except (ValueError, AttributeError, requests.RequestException) as e:
+        # blocked responses are not json or have no token
+        raise ProxyException(f"translate failed {type(e).__name__}: {e}") from e
+    return lines
+
+
+def translate_many(manager, texts, src="auto", dest="en", per_proxy=2, tries=2):
+    """ translate many texts using cache then chunks spread across the proxy pool
+    :param manager: Manager or create_lease_client(). None for no proxy.
+    :param texts: iterable of texts
+    :param per_proxy: requests in flight per proxy
+    :param tries: proxies to try per chunk
+    :return: list of translations in order of texts. ProxyException if chunk failed.
+    """
+    texts = list(texts)
+    results = [None] * len(texts)
+
+    # dict(text=positions) for texts not in cache
+    todo = dict()
+    for i, text in enumerate(texts):
+        if not text.strip():
+            results[i] = text
+            continue
+        value = None if cache is None else cache.get(get_key(text, src, dest))
+        if value is None:
+            todo.setdefault(text, []).append(i)
+        else:
+            results[i] = value
+    chunks = chunk(list(todo))
+    log.info(f"translating {len(todo)} texts in {len(chunks)} requests")
+
+    if manager is None:
+        done = []
+        for item in chunks:
+            try:
+                done.append((item, translate(None, item, src, dest)))
+            except ProxyException as e:
+                done.append((item, e))
+    else:
+        done = Batch(manager, translate, chunks, per_proxy, tries, src=src, dest=dest)
+
+    for item, lines in done:
+        for i, text in enumerate(item):
+            value = lines if isinstance(lines, Exception) else lines[i]
+            if cache is not None and not isinstance(value, Exception):
+                cache.set(get_key(text, src, dest), value)
+            for position in todo[text]:
+                results[position] = value
+    return results
+
 
 class Translate:
     """ manager client for google translate
 
-    todo NOT UPDATED TO FIT EVERYTHING ELSE> ALSO DOES NOT WORK AS GOOGLE SPOTS SWITCHES
-
     Usage::
 
         t = Translate(manager)
         t.translate("something", src="en", dest="de")
+        t.translate_many(texts, src="en", dest="de")
     """
 
     def __init__(self, manager=None):
         """
-        :param manager: manager object or client connection. None for translate without proxies
+        :param manager: Manager or create_lease_client(). None for no proxies.
         """
         self.manager = manager
 
-        if manager is None:
-            self.proxy = None
-            self.translator = Translator()
-        else:
-            self.proxy = manager.get_url()
-            # note cannot set translator.session directly as translator init passes session to other objects
-            self.translator = Translator(
-                proxies=dict(http=self.proxy, https=self.proxy), timeout=7
-            )
-
-    def refresh(self):
-        """ refresh translator session with a new proxy """
-        self.manager.replace(self.proxy)
-        self.translator.session.close()
-        self.proxy = self.manager.get_url()
-        self.translator = Translator(
-            proxies=dict(http=self.proxy, https=self.proxy), timeout=7
-        )
-        # if google translate not responding then raise exception
-        text = self.translator.translate(
-            "The cat sat on the mat", src="en", dest="fr"
-        ).text
-        log.info(f"{self.proxy} {text}")
-
     def translate(self, text, src="auto", dest="en"):
         """
         :return: translated text
         """
-        raise NotImplementedError(
-            "this does not currently work as google recognises proxy switches even if elite"
-        )
-        while True:
-            try:
-                log.info(f"translating {src} to {dest} for {text[:100]}")
-                return self.translator.translate(text, src=src, dest=dest).text
-            except Exception as e:
-                if self.manager is None:
-                    raise
-                # get new proxy and try again
-                log.warning(
-                    f"api limit reached. replacing {self.proxy}. exception={type(e)}"
-                )
-                self.refresh()
-                return ""
+        result = self.translate_many([text], src=src, dest=dest)[0]
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def translate_many(self, texts, src="auto", dest="en", **kwargs):
+        """ see translate_many """
+        return translate_many(self.manager, texts, src=src, dest=dest, **kwargs)
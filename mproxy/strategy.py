@@ -0,0 +1,57 @@
+"""
+strategies used by Manager to select the next proxy
+
+Each strategy has select(ready) that returns a proxy from the deque of ready proxies.
+Stats are recorded on the proxy by its session (see Proxy.record).
+"""
+import random
+
+
+class RoundRobin:
+    """ each proxy in turn. O(1) """
+
+    def select(self, ready):
+        proxy = ready[0]
+        ready.rotate(-1)
+        return proxy
+
+
+class LeastOutstanding:
+    """ proxy with fewest requests in flight """
+
+    def select(self, ready):
+        return min(ready, key=lambda p: p.outstanding)
+
+
+class EWMA:
+    """ proxy with lowest expected cost
+
+    cost is average latency scaled by requests in flight and by recent error rate so slow
+    or failing proxies are drained before they are blocked. Untried proxies cost zero.
+    """
+
+    def __init__(self, penalty=10):
+        """
+        :param penalty: cost multiplier for a proxy that always errors
+        """
+        self.penalty = penalty
+
+    def cost(self, proxy):
+        return (
+            (proxy.latency or 0)
+            * (proxy.outstanding + 1)
+            * (1 + self.penalty * proxy.errors)
+        )
+
+    def select(self, ready):
+        return min(ready, key=self.cost)
+
+
+class PowerOfTwo(EWMA):
+    """ lower cost of two random proxies. O(1) and avoids herding on a single best proxy """
+
+    def select(self, ready):
+        if len(ready) == 1:
+            return ready[0]
+        a, b = random.sample(range(len(ready)), 2)
+        return min(ready[a], ready[b], key=self.cost)
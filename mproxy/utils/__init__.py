@@ -1,2 +1,18 @@
-from .retry import Retry
-from .share import create_client, create_server
+from importlib import import_module
+
+from .retry import Retry, RetryBudget
+
+# multiprocessing is only loaded when sharing is used
+lazy = dict(
+    create_client=".share", create_lease_client=".share", create_server=".share"
+)
+
+
+def __getattr__(name):
+    try:
+        module = lazy[name]
+    except KeyError:
+        raise AttributeError(f"module {__name__} has no attribute {name}") from None
+    value = getattr(import_module(module, __name__), name)
+    globals()[name] = value
+    return value
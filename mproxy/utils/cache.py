@@ -0,0 +1,94 @@
+"""
+persistent cache with expiry and least recently used eviction
+"""
+import json
+import sqlite3
+from threading import Lock
+from time import time
+
+
+class Cache:
+    """ sqlite key value store. values are json serialisable.
+
+    Usage::
+
+        cache = Cache("cache.db", ttl=7 * 86400, maxsize=100000)
+        cache.set("key", [1, 2])
+        cache.get("key")
+    """
+
+    def __init__(self, path=":memory:", ttl=86400, maxsize=100000):
+        """
+        :param path: sqlite file
+        :param ttl: seconds before an entry expires. None never expires.
+        :param maxsize: entries kept. least recently used are evicted.
+        """
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.lock = Lock()
+        self.con = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.con.execute(
+            "create table if not exists cache "
+            "(key text primary key, value text, created real, used real)"
+        )
+        self.con.execute("create index if not exists cache_used on cache (used)")
+        self.size = self.con.execute("select count(*) from cache").fetchone()[0]
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        """ return value or default if missing or expired """
+        now = time()
+        with self.lock:
+            row = self.con.execute(
+                "select value, created from cache where key=?", (key,)
+            ).fetchone()
+            if row is not None and self.ttl is not None and now - row[1] > self.ttl:
+                self.con.execute("delete from cache where key=?", (key,))
+                self.size -= 1
+                row = None
+            if row is None:
+                self.misses += 1
+                return default
+            self.con.execute("update cache set used=? where key=?", (now, key))
+            self.hits += 1
+        return json.loads(row[0])
+
+    def set(self, key, value):
+        """ store value and evict least recently used if full """
+        now = time()
+        value = json.dumps(value)
+        with self.lock:
+            exists = self.con.execute(
+                "select 1 from cache where key=?", (key,)
+            ).fetchone()
+            self.con.execute(
+                "insert or replace into cache values (?, ?, ?, ?)",
+                (key, value, now, now),
+            )
+            if not exists:
+                self.size += 1
+            if self.size > self.maxsize:
+                self.con.execute(
+                    "delete from cache where key in "
+                    "(select key from cache order by used limit ?)",
+                    (self.size - self.maxsize,),
+                )
+                self.size = self.maxsize
+
+    def clear(self):
+        """ delete all entries """
+        with self.lock:
+            self.con.execute("delete from cache")
+            self.size = 0
+
+    def stats(self):
+        """ return dict of hits, misses and size """
+        with self.lock:
+            total = self.hits + self.misses
+            return dict(
+                hits=self.hits,
+                misses=self.misses,
+                hit_rate=self.hits / total if total else 0,
+                size=self.size,
+            )
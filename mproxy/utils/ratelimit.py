@@ -0,0 +1,119 @@
+"""
+pace requests per target domain to stay below block thresholds
+"""
+import random
+from threading import Lock
+from time import monotonic, sleep
+from urllib.parse import urlparse
+
+
+class TokenBucket:
+    """ token bucket. tokens added at rate up to burst. each request takes one token """
+
+    def __init__(self, rate, burst=1):
+        """
+        :param rate: requests per second
+        :param burst: requests that can be sent without waiting after a quiet period
+        """
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = monotonic()
+        self.lock = Lock()
+
+    def reserve(self):
+        """ take a token
+        :return: seconds to wait before sending. callers queue in order of reservation.
+        """
+        with self.lock:
+            now = monotonic()
+            self.tokens = min(
+                self.burst, self.tokens + (now - self.updated) * self.rate
+            )
+            self.updated = now
+            self.tokens -= 1
+            return 0 if self.tokens >= 0 else -self.tokens / self.rate
+
+
+class RateLimiter:
+    """ token bucket per domain with random jitter
+
+    Usage::
+
+        limiter = RateLimiter({"google.com": (0.2, 3)}, jitter=1)
+        limiter.wait("https://www.google.com/search")
+    """
+
+    def __init__(self, rates=None, jitter=0):
+        """
+        :param rates: dict(domain=rate or (rate, burst)). domain matches subdomains. rate
+            is requests per second. unlisted domains are not limited.
+        :param jitter: maximum random seconds added to each delay of a limited domain
+        """
+        self.rates = rates or dict()
+        self.jitter = jitter
+
+        # buckets created on first request dict(domain=TokenBucket)
+        self.buckets = dict()
+        self.lock = Lock()
+
+        # stats
+        self.requests = 0
+        self.waits = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def get_bucket(self, url):
+        """ return bucket for url or None if not limited """
+        host = urlparse(url).hostname or ""
+        for domain, rate in self.rates.items():
+            if host == domain or host.endswith(f".{domain}"):
+                break
+        else:
+            return None
+        with self.lock:
+            try:
+                return self.buckets[domain]
+            except KeyError:
+                rate, burst = rate if isinstance(rate, tuple) else (rate, 1)
+                bucket = TokenBucket(rate, burst)
+                self.buckets[domain] = bucket
+                return bucket
+
+    def delay(self, url):
+        """ reserve a slot for url
+        :return: seconds caller must wait before sending
+        """
+        bucket = self.get_bucket(url)
+        delay = 0
+        if bucket is not None:
+            delay = bucket.reserve()
+            if self.jitter:
+                delay += random.uniform(0, self.jitter)
+        with self.lock:
+            self.requests += 1
+            if delay > 0:
+                self.waits += 1
+                self.total_wait += delay
+                self.max_wait = max(self.max_wait, delay)
+        return delay
+
+    def wait(self, url):
+        """ sleep until url can be sent
+        :return: seconds waited
+        """
+        delay = self.delay(url)
+        if delay > 0:
+            sleep(delay)
+        return delay
+
+    def stats(self):
+        """ return dict of wait stats """
+        with self.lock:
+            return dict(
+                requests=self.requests,
+                waits=self.waits,
+                total_wait=self.total_wait,
+                max_wait=self.max_wait,
+                mean_wait=self.total_wait / self.requests if self.requests else 0,
+            )
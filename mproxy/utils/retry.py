@@ -1,20 +1,86 @@
-from functools import wraps
-from time import sleep
-
 import logging
+import random
+from functools import wraps
+from inspect import iscoroutinefunction
+from threading import Lock
+from time import monotonic, sleep
 
 log = logging.getLogger(__name__)
 
 
+class RetryBudget:
+    """ retries shared across calls. stops retry storms when many calls fail at once.
+
+    each call deposits ratio tokens and each retry takes one. tokens also accrue at
+    per_second so occasional retries are always possible.
+    """
+
+    def __init__(self, ratio=0.5, per_second=1, burst=20):
+        """
+        :param ratio: retries allowed per call
+        :param per_second: retries allowed per second regardless of calls
+        :param burst: maximum tokens
+        """
+        self.ratio = ratio
+        self.per_second = per_second
+        self.burst = burst
+        self.tokens = burst
+        self.updated = monotonic()
+        self.lock = Lock()
+
+    def _refill(self):
+        now = monotonic()
+        self.tokens = min(
+            self.burst, self.tokens + (now - self.updated) * self.per_second
+        )
+        self.updated = now
+
+    def deposit(self):
+        """ record a call """
+        with self.lock:
+            self._refill()
+            self.tokens = min(self.burst, self.tokens + self.ratio)
+
+    def withdraw(self):
+        """ take token for a retry
+        :return: False if budget exhausted
+        """
+        with self.lock:
+            self._refill()
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+
 class Retry:
-    """ decorator to retry a function after exceptions """
+    """ decorator to retry a function or coroutine function after exceptions
+
+    the last exception is re-raised unchanged when retries run out.
+    """
 
-    def __init__(self, tries=3, delay=1, exceptions=None, warn=1):
+    def __init__(
+        self,
+        tries=3,
+        delay=1,
+        exceptions=None,
+        warn=1,
+        backoff=1,
+        max_delay=None,
+        jitter=0,
+        deadline=None,
+        budget=None,
+    ):
         """
         :param tries: number of times to try
-        :param delay: seconds to delay between retries
+        :param delay: seconds to delay before first retry
         :param exceptions: exception or list/tuple of exceptions to tries. None is all.
-        :param warn: number of warning messages to issue
+        :param warn: number of warning messages to issue per call
+        :param backoff: multiplier for delay after each retry e.g. 2 for exponential
+        :param max_delay: maximum seconds to delay. None is no limit.
+        :param jitter: fraction of each delay that is random e.g. 1 for full jitter
+        :param deadline: seconds from first try after which no retries start
+        :param budget: RetryBudget shared with other calls. None is unlimited.
         """
         self.tries = tries
         self.delay = delay
@@ -23,25 +89,71 @@ class Retry:
             isinstance(self.exceptions, list) or isinstance(self.exceptions, tuple)
         ):
             self.exceptions = (self.exceptions,)
+        self.exceptions = tuple(self.exceptions)
         self.warn = warn
+        self.backoff = backoff
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.deadline = deadline
+        self.budget = budget
+
+    def start(self):
+        """ record a call before the first try
+        :return: deadline as monotonic time. None if no deadline.
+        """
+        if self.budget is not None:
+            self.budget.deposit()
+        return None if self.deadline is None else monotonic() + self.deadline
+
+    def delays(self, func, end):
+        """ yield delay before each retry. stops when no retries left.
+        :param end: deadline from start
+        """
+        delay = self.delay
+        for n in range(1, self.tries):
+            wait = delay * (1 - self.jitter * random.random())
+            if self.max_delay is not None:
+                wait = min(wait, self.max_delay)
+            if end is not None and monotonic() + wait > end:
+                log.warning(f"{func.__module__}.{func.__name__} deadline reached")
+                return
+            if self.budget is not None and not self.budget.withdraw():
+                log.warning(f"{func.__module__}.{func.__name__} retry budget exhausted")
+                return
+            if n <= self.warn:
+                log.warning(f"waiting for {func.__module__}.{func.__name__} tries={n}")
+            yield wait
+            delay *= self.backoff
 
     def __call__(self, func):
-        @wraps(func)
-        def inner(*args, **kwargs):
-            last_exception = Exception
-            for n in range(self.tries):
-                try:
-                    return func(*args, **kwargs)
-                except self.exceptions as e:
-                    last_exception = type(e)
-                    if self.warn > 0:
-                        log.warning(
-                            f"waiting for {func.__module__}.{func.__name__} tries={n+1}"
-                        )
-                        self.warn -= 1
-                    sleep(self.delay)
-            raise last_exception(
-                f"failed {func.__module__}.{func.__name__} tries={n+1}"
-            )
+        if iscoroutinefunction(func):
+            # asyncio is slow to import and only needed for coroutine functions
+            import asyncio
+
+            @wraps(func)
+            async def inner(*args, **kwargs):
+                delays = self.delays(func, self.start())
+                while True:
+                    try:
+                        return await func(*args, **kwargs)
+                    except self.exceptions:
+                        wait = next(delays, None)
+                        if wait is None:
+                            raise
+                    await asyncio.sleep(wait)
+
+        else:
+
+            @wraps(func)
+            def inner(*args, **kwargs):
+                delays = self.delays(func, self.start())
+                while True:
+                    try:
+                        return func(*args, **kwargs)
+                    except self.exceptions:
+                        wait = next(delays, None)
+                        if wait is None:
+                            raise
+                    sleep(wait)
 
         return inner
@@ -2,8 +2,10 @@
 convenience functions for sharing objects with multiple processes or machines
 """
 import logging
+from collections import deque
 from multiprocessing.managers import BaseManager
-from threading import Thread
+from queue import Queue
+from threading import Condition, Thread
 
 log = logging.getLogger(__name__)
 
@@ -58,3 +60,148 @@ def create_client(ip=ip, port=port, authkey=authkey):
     m = Manager((ip, port), authkey=authkey)
     m.connect()
     return m.get_obj()
+
+
+def create_lease_client(ip=ip, port=port, authkey=authkey, n=None, refresh=60):
+    """ return client that leases proxies from a Manager shared with create_server
+
+    Requests are sent from local sessions so only lease and block calls go to the server.
+
+    :param ip: ip address for server
+    :param port: port number for server
+    :param authkey: binary key to be used by server and client
+    :param n: proxies per lease. None for all.
+    :param refresh: seconds between leases to pick up new proxies
+    :return: LeaseClient with same session interface as Manager
+    """
+    return LeaseClient(create_client(ip, port, authkey), n=n, refresh=refresh)
+
+
+class LeaseClient:
+    """ rotates local sessions for proxies leased from a shared Manager
+
+    Blocks are removed locally at once and reported to the server in the background.
+    """
+
+    def __init__(self, manager, n=None, refresh=60):
+        """
+        :param manager: Manager or proxy object from create_client
+        :param n: proxies per lease. None for all.
+        :param refresh: seconds between leases to pick up new proxies
+        """
+        self.manager = manager
+        self.n = n
+        self.refresh = refresh
+
+        # local proxies in rotation order dict(ip=proxy)
+        self.proxies = dict()
+        self.ready = deque()
+        self.lock = Condition()
+
+        # blocked urls to report to server and ips not yet reported
+        self.blocked = Queue()
+        self.blocking = set()
+
+        Thread(target=self._report, daemon=True, name="lease report").start()
+        Thread(target=self._renew, daemon=True, name="lease renew").start()
+
+    def lease(self):
+        """ replace local proxies with a new lease from the server """
+        from ..manager import get_ip
+        from ..proxy.proxy import Proxy
+
+        leased = self.manager.lease(self.n)
+        with self.lock:
+            proxies = dict()
+            for urls in leased:
+                ip = get_ip(urls["http"])
+                if ip in self.blocking:
+                    continue
+                proxy = self.proxies.get(ip)
+                if proxy is None:
+                    proxy = Proxy()
+                    proxy.session = proxy.get_session(ip)
+                    proxy.session.proxies = urls
+                proxies[ip] = proxy
+            for ip, proxy in self.proxies.items():
+                if ip not in proxies:
+                    proxy.session.close()
+            self.proxies = proxies
+            self.ready = deque(proxies.values())
+            self.lock.notify_all()
+
+    def _renew(self):
+        """ lease periodically """
+        while True:
+            try:
+                self.lease()
+            except Exception:
+                log.exception("lease failed")
+            with self.lock:
+                self.lock.wait(self.refresh)
+
+    def _report(self):
+        """ report blocks to server """
+        from ..manager import get_ip
+
+        while True:
+            url = self.blocked.get()
+            try:
+                self.manager.report(url)
+            except Exception:
+                log.exception(f"failed to report block {url}")
+            with self.lock:
+                self.blocking.discard(get_ip(url))
+            # lease now rather than wait for refresh if running low
+            if len(self.ready) < 2:
+                with self.lock:
+                    self.lock.notify_all()
+
+    def get_session(self, timeout=None):
+        """ return next local proxy session
+        :param timeout: seconds to wait for a proxy. None waits forever.
+        """
+        with self.lock:
+            if not self.lock.wait_for(lambda: self.ready, timeout):
+                raise TimeoutError(f"no proxies after {timeout}s")
+            proxy = self.ready[0]
+            self.ready.rotate(-1)
+            return proxy.session
+
+    def session(self, proxy):
+        """ return session for local proxy """
+        return proxy.session
+
+    def wait(self, n, timeout=None):
+        """ wait until local proxies available
+        :param n: number of proxies for which to wait
+        :param timeout: seconds to wait. None waits forever.
+        """
+        with self.lock:
+            if not self.lock.wait_for(lambda: len(self.ready) >= n, timeout):
+                raise TimeoutError(f"{len(self.ready)}/{n} proxies after {timeout}s")
+
+    def block(self, url):
+        """ stop using proxy and report block to server
+        :param url: proxy url
+        """
+        from ..manager import get_ip
+
+        with self.lock:
+            proxy = self.proxies.pop(get_ip(url), None)
+            if proxy is None:
+                return
+            self.ready.remove(proxy)
+            self.blocking.add(get_ip(url))
+        proxy.session.close()
+        self.blocked.put(url)
+
+    def get_proxy_session(self):
+        """ return session that will automatically switch proxies """
+        from ..proxysession import ProxySession
+
+        return ProxySession(self)
+
+    def get_proxy_function(self, func):
+        """ return function that on ProxyException => replaces session and retries """
+        return self.get_proxy_session().get_proxy_function(func)
@@ -22,6 +22,11 @@ params = dict(
 
 ########## EDIT BELOW THIS LINE ONLY ##########
 
+# pandas is not used. requests[socks] for Tor, lxml for google pages, aiohttp for
+# AsyncManager.
+params['install_requires'] = ['fabric', 'stem', 'apache_libcloud',
+                              'requests[socks]', 'beautifulsoup4', 'lxml',
+                              'googletrans', 'aiohttp']
 
 ########## EDIT ABOVE THIS LINE ONLY ##########
 